@@ -1,6 +1,5 @@
 
 import streamlit as st
-from clo_model import run_clo_model
 
 st.set_page_config(page_title="CLO Waterfall Model", layout="wide")
 
@@ -35,6 +34,9 @@ if view == "home":
             st.rerun()
 
 elif view == "clo":
+    # Imported on first use so the home view renders without loading pandas and the model code.
+    from clo_model import run_clo_model
+
     run_clo_model()
 
 else:
@@ -0,0 +1,216 @@
+import argparse
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from clo_export import ResultWriter
+from clo_metrics import METRICS
+from clo_periodic_cashflow import CASHFLOW_COLUMNS, run_clo_waterfall
+from clo_store import ResultStore, row_keys
+
+INPUT_COLUMNS = ["total_collateral", "senior_size", "mezz_size", "equity_size", "senior_rate", "mezz_rate",
+                 "default_rate", "recovery_rate", "collateral_yield", "years", "reinvest_toggle"]
+RESULT_COLUMNS = ["Senior IRR", "Mezz IRR", "Equity IRR"] + CASHFLOW_COLUMNS
+# Approximate peak memory of computing one scenario, in bytes per month of its horizon (measured with
+# tracemalloc, rounded up): results only, and with the long-format monthly cash flows and their CSV
+# formatting. Used to size chunks under a memory budget.
+SUMMARY_BYTES_PER_MONTH = 64
+MONTHLY_BYTES_PER_MONTH = 256
+
+
+def with_defaults(scenarios):
+    # Fills the optional equity_size (the rest of the collateral) and reinvest_toggle (off) columns and
+    # checks that every other simulate_clo_cashflows input is present.
+    if "equity_size" not in scenarios:
+        scenarios["equity_size"] = scenarios["total_collateral"] - scenarios["senior_size"] - scenarios["mezz_size"]
+    if "reinvest_toggle" not in scenarios:
+        scenarios["reinvest_toggle"] = False
+    missing = [c for c in INPUT_COLUMNS if c not in scenarios]
+    if missing:
+        raise ValueError(f"scenario input is missing columns: {', '.join(missing)}")
+    return scenarios
+
+
+def run_scenario_frame(scenarios):
+    # One output row per input row: the input columns (plus any pass-through columns such as deal or
+    # scenario ids) followed by tranche IRRs and total cash flows. Rows sharing a horizon and reinvestment
+    # flag run as one batched waterfall.
+    scenarios = with_defaults(scenarios.reset_index(drop=True))
+    out = np.full((len(scenarios), len(RESULT_COLUMNS)), np.nan)
+    for (years, reinvest_toggle), group in scenarios.groupby(["years", "reinvest_toggle"], sort=False):
+        result = run_clo_waterfall(*(group[c].to_numpy() for c in INPUT_COLUMNS[:-2]), years=years,
+                                   reinvest_toggle=bool(reinvest_toggle), summary_only=True)
+        out[group.index.to_numpy()] = np.column_stack(
+            result.irr() + tuple(result.totals[c] for c in CASHFLOW_COLUMNS))
+    return pd.concat([scenarios, pd.DataFrame(out, columns=RESULT_COLUMNS)], axis=1)
+
+
+def run_monthly_frame(scenarios, start=0):
+    # Long-format monthly cash flows for every input row: one row per (scenario, month), scenarios numbered
+    # from `start` in input order.
+    scenarios = with_defaults(scenarios.reset_index(drop=True))
+    frames = []
+    for (years, reinvest_toggle), group in scenarios.groupby(["years", "reinvest_toggle"], sort=False):
+        result = run_clo_waterfall(*(group[c].to_numpy() for c in INPUT_COLUMNS[:-2]), years=years,
+                                   reinvest_toggle=bool(reinvest_toggle))
+        months, n = result.months, len(group)
+        frame = pd.DataFrame(result.monthly.transpose(2, 1, 0).reshape(n * months, -1), columns=CASHFLOW_COLUMNS)
+        frame.insert(0, "Month", np.tile(np.arange(1, months + 1), n))
+        frame.insert(0, "Scenario", np.repeat(group.index.to_numpy() + start, months))
+        frames.append(frame)
+    return pd.concat(frames).sort_values("Scenario", kind="stable", ignore_index=True)
+
+
+def _run_chunk(chunk, start, monthly, missing=None):
+    # Results for the rows of chunk selected by the boolean `missing` mask (all rows when None), and the
+    # monthly cash flows of the whole chunk when requested.
+    computed = run_scenario_frame(chunk if missing is None else chunk[missing])
+    return computed, run_monthly_frame(chunk, start) if monthly else None
+
+
+def budget_rows(memory_budget, months, monthly=False, in_flight=1):
+    # Scenarios per chunk that keep `in_flight` chunks of `months`-month scenarios within memory_budget
+    # bytes (at least one).
+    per_row = months * (MONTHLY_BYTES_PER_MONTH if monthly else SUMMARY_BYTES_PER_MONTH) * in_flight
+    return max(1, int(memory_budget // per_row))
+
+
+def _within_budget(chunks, memory_budget, monthly, in_flight):
+    # Splits the chunks of read_scenarios further wherever one would not fit memory_budget, sized by that
+    # chunk's own longest horizon.
+    for chunk in chunks:
+        if memory_budget is None or "years" not in chunk or not len(chunk):
+            yield chunk
+            continue
+        rows = budget_rows(memory_budget, max(int(chunk["years"].max() * 12), 1), monthly, in_flight)
+        for start in range(0, len(chunk), rows):
+            yield chunk.iloc[start:start + rows]
+
+
+def read_scenarios(path, chunksize):
+    if isinstance(path, pd.DataFrame):
+        for start in range(0, len(path), chunksize):
+            yield path.iloc[start:start + chunksize]
+    elif path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def run_batch(input_path, output_path, chunksize=50_000, workers=1, monthly=False, store=None, memory_budget=None):
+    # Streams input_path (a CSV/Parquet path or a DataFrame) through run_scenario_frame chunk by chunk and
+    # writes results in input order to a CSV, Parquet or xlsx output_path. With monthly, the long-format
+    # monthly cash flows of every scenario are written as well, to a "Monthly Cashflows" sheet or sibling
+    # file. With a ResultStore, each chunk is first looked up in bulk and only the scenarios it does not
+    # hold are computed (and then stored); monthly cash flows are not stored and are always recomputed.
+    # At most 2 * workers chunks are in flight, which bounds memory whatever the input size; with a
+    # memory_budget (bytes) chunks are also cut small enough for those in-flight chunks to stay within it,
+    # so the budget rather than chunksize decides how much is computed at once. Returns the number of
+    # scenarios written.
+    rows = 0
+    submitted = 0
+    chunks = _within_budget(read_scenarios(input_path, chunksize), memory_budget, monthly,
+                            1 if workers <= 1 else 2 * workers)
+
+    def prepare(chunk):
+        # (chunk, store lookup, rows to compute or None for all, whether anything needs computing)
+        chunk = with_defaults(chunk.reset_index(drop=True))
+        if store is None:
+            return chunk, None, None, True
+        with METRICS.span("batch_store_lookup"):
+            keys = row_keys(chunk, INPUT_COLUMNS)
+            values, found = store.get_rows(keys, len(RESULT_COLUMNS))
+        return chunk, (keys, values, found), ~found, monthly or not found.all()
+
+    def write(chunk, lookup, results):
+        nonlocal rows
+        frame, monthly_frame = results if results is not None else (None, None)
+        if lookup is not None:
+            keys, values, found = lookup
+            if not found.all():
+                values[~found] = frame[RESULT_COLUMNS].to_numpy()
+                with METRICS.span("batch_store_write"):
+                    store.put_rows(keys[~found], values[~found])
+            frame = pd.concat([chunk, pd.DataFrame(values, columns=RESULT_COLUMNS)], axis=1)
+        with METRICS.span("batch_write"):
+            writer.write(frame)
+            if monthly_frame is not None:
+                writer.write(monthly_frame, "Monthly Cashflows")
+        rows += len(frame)
+        METRICS.incr("batch_scenarios", len(frame))
+
+    def write_next(pending):
+        # In parallel runs the compute happens in worker processes, which keep their own metrics; the
+        # parent records how long it waits for each chunk.
+        chunk, lookup, future = pending.popleft()
+        with METRICS.span("batch_wait"):
+            results = future and future.result()
+        write(chunk, lookup, results)
+
+    with ResultWriter(output_path) as writer:
+        if workers <= 1:
+            for chunk in chunks:
+                chunk, lookup, missing, compute = prepare(chunk)
+                with METRICS.span("batch_compute"):
+                    results = _run_chunk(chunk, rows, monthly, missing) if compute else None
+                write(chunk, lookup, results)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    chunk, lookup, missing, compute = prepare(chunk)
+                    future = pool.submit(_run_chunk, chunk, submitted, monthly, missing) if compute else None
+                    pending.append((chunk, lookup, future))
+                    submitted += len(chunk)
+                    if len(pending) >= 2 * workers:
+                        write_next(pending)
+                while pending:
+                    write_next(pending)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a CSV/Parquet file of CLO deals and scenarios through "
+                                                 "the cash-flow engine without the Streamlit UI.")
+    parser.add_argument("input", help="scenario file (.csv or .parquet) with one column per "
+                                      "simulate_clo_cashflows argument")
+    parser.add_argument("output", help="result file (.csv, .parquet or .xlsx), written incrementally")
+    parser.add_argument("--chunksize", type=int, default=50_000, help="scenarios per chunk (default 50000)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help=f"worker processes (default 1, this machine has {os.cpu_count()})")
+    parser.add_argument("--monthly", action="store_true",
+                        help="also write every scenario's monthly cash flows (to a sibling file or xlsx sheet)")
+    parser.add_argument("--store", metavar="PATH",
+                        help="SQLite result store; scenarios already in it are not recomputed")
+    parser.add_argument("--store-max-mb", type=int, default=1024,
+                        help="evict least recently used results beyond this size (default 1024)")
+    parser.add_argument("--memory-budget-mb", type=int,
+                        help="shrink chunks so the scenarios being computed stay within this much memory")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write timing spans and counters to PATH (Prometheus text for .prom/.txt, else JSON)")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        METRICS.enabled = True
+    store = ResultStore(args.store, args.store_max_mb << 20) if args.store else None
+    memory_budget = args.memory_budget_mb << 20 if args.memory_budget_mb else None
+    rows = run_batch(args.input, args.output, args.chunksize, args.workers, args.monthly, store, memory_budget)
+    print(f"wrote {rows} scenarios to {args.output}", file=sys.stderr)
+    if store is not None:
+        stats = store.stats()
+        print(f"result store: {stats['hits']} hits, {stats['misses']} computed, {stats['evictions']} evicted, "
+              f"{stats['entries']} entries ({stats['bytes'] / 2 ** 20:.1f} MB)", file=sys.stderr)
+        store.close()
+    if args.metrics:
+        METRICS.dump(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
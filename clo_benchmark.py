@@ -0,0 +1,350 @@
+import argparse
+import itertools
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import numpy_financial as npf
+import pandas as pd
+
+from clo_batch import INPUT_COLUMNS
+from clo_collateral import LoanPool, project_pool, run_pool_waterfall
+from clo_compact import PRECISIONS, run_compact
+from clo_irr import irr
+from clo_monte_carlo import run_monte_carlo, summarize_monte_carlo
+from clo_periodic_cashflow import (STRESS_SCENARIOS, run_clo_waterfall, simulate_clo_cashflows,
+                                   simulate_clo_cashflows_batch)
+from clo_portfolio import run_portfolio
+from clo_waterfall import compile_waterfall, flat_collateral, run_waterfall, two_tranche_spec
+
+DEAL = dict(total_collateral=110_000_000, senior_size=60_000_000, mezz_size=40_000_000, equity_size=10_000_000,
+            senior_rate=4.0, mezz_rate=8.0, default_rate=10.0, recovery_rate=30.0, collateral_yield=10.0)
+
+
+def _reference_simulate_clo_cashflows(total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+                                      default_rate, recovery_rate, collateral_yield, years, reinvest_toggle=False):
+    # The original row-by-row implementation, kept verbatim as the golden reference for faster engines.
+    months = years * 12
+    senior_bal = senior_size
+    mezz_bal = mezz_size
+
+    senior_cf = [-senior_size]
+    mezz_cf = [-mezz_size]
+    equity_cf = [-equity_size]
+
+    df = pd.DataFrame(columns=["Month", "Senior Interest", "Senior Principal", "Mezz Interest", "Mezz Principal",
+                               "Equity Cash"])
+    for m in range(1, months + 1):
+        int_income = total_collateral * (collateral_yield / 100 / 12)
+        default_amt = total_collateral * (default_rate / 100 / months)
+        recovery_amt = default_amt * (recovery_rate / 100)
+        available_cash = int_income + recovery_amt - default_amt
+
+        sr_int_due = senior_bal * (senior_rate / 100 / 12)
+        sr_int_paid = min(sr_int_due, available_cash)
+        available_cash -= sr_int_paid
+
+        mz_int_due = mezz_bal * (mezz_rate / 100 / 12)
+        mz_int_paid = min(mz_int_due, available_cash)
+        available_cash -= mz_int_paid
+
+        if reinvest_toggle and m <= 36:
+            sr_prin_paid = 0
+            mz_prin_paid = 0
+        else:
+            sr_prin_sched = senior_size / months
+            sr_prin_paid = min(sr_prin_sched, senior_bal, available_cash)
+            senior_bal -= sr_prin_paid
+            available_cash -= sr_prin_paid
+
+            mz_prin_sched = mezz_size / months
+            mz_prin_paid = min(mz_prin_sched, mezz_bal, available_cash)
+            mezz_bal -= mz_prin_paid
+            available_cash -= mz_prin_paid
+
+        eq_paid = max(available_cash, 0)
+
+        senior_cf.append(sr_int_paid + sr_prin_paid)
+        mezz_cf.append(mz_int_paid + mz_prin_paid)
+        equity_cf.append(eq_paid)
+
+        df.loc[m] = [m, sr_int_paid, sr_prin_paid, mz_int_paid, mz_prin_paid, eq_paid]
+
+    sr_irr = npf.irr(senior_cf) * 12 * 100
+    mz_irr = npf.irr(mezz_cf) * 12 * 100
+    eq_irr = npf.irr(equity_cf) * 12 * 100
+
+    return df, sr_irr, mz_irr, eq_irr
+
+
+def _same_irr(a, b, tol=1e-8):
+    return (np.isnan(a) and np.isnan(b)) or abs(a - b) <= tol * max(1.0, abs(a))
+
+
+def golden_cases():
+    grid = itertools.product([0.0, 5.0, 15.0, 40.0], [0.0, 30.0, 100.0], [5.0, 10.0, 20.0], [1, 5, 10],
+                             [False, True], [0, 10_000_000])
+    for default_rate, recovery_rate, collateral_yield, years, reinvest_toggle, equity_size in grid:
+        yield dict(DEAL, default_rate=default_rate, recovery_rate=recovery_rate, collateral_yield=collateral_yield,
+                   equity_size=equity_size), years, reinvest_toggle
+
+
+def _benchmark_pool(seed=0):
+    rng = np.random.default_rng(seed)
+    return LoanPool(rng.uniform(5e4, 2e5, 1_000), rng.uniform(2, 5, 1_000), rng.integers(24, 144, 1_000),
+                    rng.uniform(5, 25, 1_000), rng.uniform(0, 6, 1_000))
+
+
+def check_golden():
+    # Every engine must reproduce the reference loop: identical monthly frames and cash flows, and IRRs
+    # equal to numpy_financial.irr wherever it finds a root. Returns a list of failure messages.
+    failures = []
+    cases = list(golden_cases())
+    refs = [_reference_simulate_clo_cashflows(**deal, years=years, reinvest_toggle=reinvest_toggle)
+            for deal, years, reinvest_toggle in cases]
+    for (deal, years, reinvest_toggle), ref in zip(cases, refs):
+        new = simulate_clo_cashflows(**deal, years=years, reinvest_toggle=reinvest_toggle)
+        label = f"{deal} years={years} reinvest={reinvest_toggle}"
+        try:
+            pd.testing.assert_frame_equal(ref[0], new[0], check_exact=True)
+        except AssertionError as exc:
+            failures.append(f"simulate_clo_cashflows frame differs for {label}: {exc}")
+        for name, a, b in zip(["senior", "mezz", "equity"], ref[1:], new[1:]):
+            if not _same_irr(a, b):
+                failures.append(f"simulate_clo_cashflows {name} IRR {b} != {a} for {label}")
+
+    # Batch engine and N-tranche preset against the scalar path, grouped by horizon and reinvestment flag.
+    groups = {}
+    for (deal, years, reinvest_toggle), ref in zip(cases, refs):
+        groups.setdefault((years, reinvest_toggle), []).append((deal, ref))
+    for (years, reinvest_toggle), members in groups.items():
+        frame = pd.DataFrame([deal for deal, _ in members])
+        cols = [frame[c].to_numpy() for c in DEAL]
+        batch = simulate_clo_cashflows_batch(*cols, years, reinvest_toggle)
+        months = years * 12
+        cash, interest, par = flat_collateral(frame["total_collateral"].to_numpy(), frame["default_rate"].to_numpy(),
+                                              frame["recovery_rate"].to_numpy(),
+                                              frame["collateral_yield"].to_numpy(), months)
+        preset = run_waterfall(compile_waterfall(two_tranche_spec(reinvest_toggle)),
+                               frame[["senior_size", "mezz_size"]].to_numpy(),
+                               frame[["senior_rate", "mezz_rate"]].to_numpy(), frame["equity_size"].to_numpy(),
+                               cash, interest, par, months)
+        for i, (deal, ref) in enumerate(members):
+            senior = (ref[0]["Senior Interest"] + ref[0]["Senior Principal"]).to_numpy()
+            equity = ref[0]["Equity Cash"].to_numpy()
+            label = f"{deal} years={years} reinvest={reinvest_toggle}"
+            if not (np.array_equal(batch[0][i, 1:], senior) and np.array_equal(batch[2][i, 1:], equity)):
+                failures.append(f"simulate_clo_cashflows_batch cash flows differ for {label}")
+            if not (np.array_equal(preset.cashflow("Senior")[i, 1:], senior)
+                    and np.array_equal(preset.cashflow("Equity")[i, 1:], equity)):
+                failures.append(f"two_tranche_spec preset cash flows differ for {label}")
+            for name, a, b in zip(["senior", "mezz", "equity"], ref[1:], (batch[3][i], batch[4][i], batch[5][i])):
+                if not _same_irr(a, b):
+                    failures.append(f"simulate_clo_cashflows_batch {name} IRR {b} != {a} for {label}")
+
+    # Monte Carlo: a deal that repays every scheduled dollar without defaults has no shortfall, with or
+    # without a reinvestment period (whose months schedule no principal).
+    repaying = dict(DEAL, senior_size=30_000_000, mezz_size=10_000_000, equity_size=70_000_000, default_rate=0.0)
+    for reinvest_toggle in (False, True):
+        summary = summarize_monte_carlo(run_monte_carlo(**repaying, years=5, reinvest_toggle=reinvest_toggle,
+                                                        n_paths=100, seed=0, workers=1))
+        if summary["Senior Shortfall Probability"] or summary["Mezz Shortfall Probability"]:
+            failures.append(f"run_monte_carlo reports shortfalls on a fully repaying deal (reinvest={reinvest_toggle})")
+
+    # Loan-level pool: while senior notes are outstanding, equity may only receive interest left after the
+    # note coupons, never principal proceeds; and principal is conserved between pool and notes.
+    pool = _benchmark_pool()
+    size = pool.total_balance
+    # Horizons at or inside the 36-month reinvestment period must still pay out the held principal.
+    for years, reinvest_toggle in itertools.product([2, 3, 10], [False, True]):
+        result, projection = run_pool_waterfall(pool, size * 0.65, size * 0.25, size * 0.10, 4.0, 8.0, years,
+                                                reinvest_toggle, 5.0, 60.0, 6)
+        senior_open = size * 0.65 - np.cumsum(result.column("Senior Principal")[0]) > 1e-6 * size
+        excess_interest = projection.interest - result.column("Senior Interest")[0] - result.column("Mezz Interest")[0]
+        leaked = result.column("Equity Cash")[0] - excess_interest
+        if (leaked[senior_open] > 1e-6 * size).any():
+            failures.append(f"run_pool_waterfall pays principal to equity before the senior notes are repaid "
+                            f"(years={years}, reinvest={reinvest_toggle}): {leaked[senior_open].max():,.2f}")
+        notes = result.totals["Senior Principal"][0] + result.totals["Mezz Principal"][0]
+        released = result.column("Equity Cash")[0].sum() - excess_interest.sum()
+        if abs(projection.principal.sum() - notes - released) > 1e-6 * size:
+            failures.append(f"run_pool_waterfall does not conserve principal (years={years}, "
+                            f"reinvest={reinvest_toggle})")
+
+    # Compact storage: float64 must reproduce the engine exactly, and the other precisions must keep every
+    # IRR within its documented bound.
+    deals = pd.DataFrame([dict(deal, years=years, reinvest_toggle=reinvest_toggle) for deal, years, reinvest_toggle
+                          in cases])
+    exact = run_compact(deals, "float64")
+    for i, (deal, years, reinvest_toggle) in enumerate(cases):
+        if not np.array_equal(exact.to_frame(i).to_numpy(), refs[i][0].to_numpy()):
+            failures.append(f"run_compact float64 frame differs for {deal} years={years} reinvest={reinvest_toggle}")
+    for precision in PRECISIONS[1:]:
+        compact = run_compact(deals, precision)
+        for name, a, b, bound in zip(["senior", "mezz", "equity"], exact.irr(), compact.irr(),
+                                     compact.irr_error_bound()):
+            outside = np.flatnonzero(~(np.abs(a - b) <= bound) & ~(np.isnan(a) & np.isnan(b)))
+            if len(outside):
+                failures.append(f"run_compact {precision} {name} IRR outside its error bound for {len(outside)} "
+                                f"case(s), e.g. {cases[outside[0]]}")
+    return failures
+
+
+def _measure(fn, repeat):
+    fn()
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def _sweep(n, years=10, seed=0):
+    rng = np.random.default_rng(seed)
+    return (DEAL["total_collateral"], DEAL["senior_size"], DEAL["mezz_size"], DEAL["equity_size"],
+            rng.uniform(2, 6, n), rng.uniform(6, 10, n), rng.uniform(0, 40, n), rng.uniform(0, 100, n),
+            rng.uniform(5, 20, n), years, True)
+
+
+def benchmark_cases(quick=False):
+    # name -> (callable, scenarios per call)
+    from clo_model import create_clo_annual_cashflow_summary
+
+    cases = {}
+    for years, reinvest_toggle in itertools.product([1, 5, 10], [False, True]):
+        cases[f"simulate_clo_cashflows[{years}y,reinvest={reinvest_toggle}]"] = (
+            lambda y=years, r=reinvest_toggle: simulate_clo_cashflows(**DEAL, years=y, reinvest_toggle=r), 1)
+    frame = simulate_clo_cashflows(**DEAL, years=10, reinvest_toggle=True)[0]
+    cases["create_clo_annual_cashflow_summary[10y]"] = (
+        lambda: create_clo_annual_cashflow_summary(frame.copy(), 10), 1)
+
+    flows = run_clo_waterfall(*_sweep(10_000)[:9], 10, True, summary_only=True)
+    cases["irr[1x121]"] = (lambda: irr(flows.senior_cf[:1]), 1)
+    cases["irr[10000x121]"] = (lambda: irr(flows.senior_cf), 10_000)
+    cases["npf.irr[1x121]"] = (lambda: npf.irr(flows.senior_cf[0]), 1)
+
+    rng = np.random.default_rng(0)
+    pool = _benchmark_pool()
+    cases["project_pool[1000 loans x 120]"] = (lambda: project_pool(pool, 120, 5.0, 60.0, 6), 1)
+
+    for n in [1_000, 10_000] + ([] if quick else [100_000]):
+        args = _sweep(n)
+        cases[f"sweep[{n}]"] = (lambda a=args: simulate_clo_cashflows_batch(*a), n)
+
+    deals = pd.DataFrame(dict(zip(INPUT_COLUMNS, _sweep(250, years=rng.integers(3, 11, 250)))))
+    deals["senior_weight"] = rng.uniform(0, 1, 250)
+    deals["equity_weight"] = rng.uniform(0, 1, 250)
+    cases["run_portfolio[250 deals x 3 stresses]"] = (lambda: run_portfolio(deals), 250 * len(STRESS_SCENARIOS))
+
+    n = 10_000 if quick else 100_000
+    scenarios = pd.DataFrame(dict(zip(INPUT_COLUMNS, _sweep(n))))
+    for precision in PRECISIONS:
+        cases[f"run_compact[{n},{precision}]"] = (lambda p=precision: run_compact(scenarios, p), n)
+    # Large enough to spill; close() deletes the spill directory after every call.
+    cases[f"run_compact[{n},float32,budget 64MB]"] = (
+        lambda: run_compact(scenarios, "float32", memory_budget=64 << 20).close(), n)
+    return cases
+
+
+def run_benchmarks(quick=False, repeat=3):
+    results = {}
+    for name, (fn, scenarios) in benchmark_cases(quick).items():
+        wall, peak = _measure(fn, repeat)
+        results[name] = {"wall_s": wall, "per_scenario_us": wall / scenarios * 1e6, "peak_mb": peak / 2 ** 20,
+                         "scenarios": scenarios}
+    return results
+
+
+def startup_profile(module, top=10):
+    # Cold import cost of `module` in a fresh interpreter, from python -X importtime. Returns the total in
+    # seconds and the `top` slowest top-level packages it pulled in as (name, seconds) pairs.
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                          text=True, check=True)
+    # A module's line follows those of the imports it triggered, so its direct imports are the depth-1
+    # lines since the previous depth-0 line (interpreter start-up imports and the like come before that).
+    packages = {}
+    total = 0.0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == module:
+                total = int(cumulative) / 1e6
+                break
+            packages = {}
+        elif depth == 1:
+            packages[name.strip()] = packages.get(name.strip(), 0.0) + int(cumulative) / 1e6
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return total, slowest
+
+
+def compare(results, baseline, threshold):
+    # Cases whose wall time grew by more than `threshold` (a ratio) relative to the baseline.
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base and result["wall_s"] > base["wall_s"] * threshold:
+            regressions.append(f"{name}: {result['wall_s'] * 1e3:.2f} ms vs baseline {base['wall_s'] * 1e3:.2f} ms "
+                               f"({result['wall_s'] / base['wall_s']:.2f}x > {threshold:.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark and golden-output checks for the CLO cash-flow and "
+                                                 "IRR paths.")
+    parser.add_argument("--quick", action="store_true", help="skip the 100k-scenario sweep")
+    parser.add_argument("--repeat", type=int, default=3, help="timed repetitions per case (best is kept)")
+    parser.add_argument("--save", metavar="PATH", help="write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="fail if a case regressed against this JSON baseline")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="allowed wall-time ratio against the baseline (default 1.25)")
+    parser.add_argument("--golden-only", action="store_true", help="only run the golden-output checks")
+    parser.add_argument("--startup", action="store_true",
+                        help="also profile cold-start import time of the app's home and CLO views")
+    args = parser.parse_args(argv)
+
+    failures = check_golden()
+    print(f"golden checks: {len(failures)} failure(s)")
+    for failure in failures:
+        print(f"  {failure}")
+    if failures or args.golden_only:
+        return 1 if failures else 0
+
+    results = run_benchmarks(args.quick, args.repeat)
+    if args.startup:
+        # The home view only needs streamlit; the CLO view additionally imports clo_model.
+        for view, module in [("home", "streamlit"), ("clo", "clo_model")]:
+            total, slowest = startup_profile(module)
+            results[f"startup[{view}]"] = {"wall_s": total, "per_scenario_us": np.nan, "peak_mb": np.nan,
+                                           "scenarios": 0}
+            print(f"startup[{view}] import {module}: {total * 1e3:.0f} ms; slowest packages: "
+                  + ", ".join(f"{name} {seconds * 1e3:.0f} ms" for name, seconds in slowest))
+    print(f"{'case':<48} {'wall ms':>10} {'us/scenario':>12} {'peak MB':>9}")
+    for name, r in results.items():
+        print(f"{name:<48} {r['wall_s'] * 1e3:>10.2f} {r['per_scenario_us']:>12.2f} {r['peak_mb']:>9.1f}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
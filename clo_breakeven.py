@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+from clo_batch import INPUT_COLUMNS, with_defaults
+from clo_irr import irr
+from clo_periodic_cashflow import run_clo_waterfall, scheduled_principal
+
+CONVERGED = "converged"
+IMPAIRED_AT_BOUNDS = "impaired throughout bounds"
+NOT_IMPAIRED = "not impaired within bounds"
+
+# Search ranges (in the inputs' own units) for the variables the solver moves by default.
+SOLVER_BOUNDS = {
+    "default_rate": (0.0, 100.0),
+    "recovery_rate": (0.0, 100.0),
+    "collateral_yield": (0.0, 30.0),
+    "senior_rate": (0.0, 20.0),
+    "mezz_rate": (0.0, 30.0),
+}
+TRANCHES = ["Senior", "Mezz", "Equity"]
+# Relative principal shortfall (of tranche size) below which a tranche still counts as paid in full, so
+# rounding in the monthly sums is not mistaken for impairment.
+SHORTFALL_TOLERANCE = 1e-6
+
+
+def _impaired(params, years, reinvest_toggle, tranche, target_irr):
+    # Boolean per row: principal shortfall on `tranche` (target_irr None) or its annualised IRR below
+    # target_irr (no IRR at all counts as below).
+    result = run_clo_waterfall(*(params[c] for c in INPUT_COLUMNS[:-2]), years, reinvest_toggle, summary_only=True)
+    if target_irr is not None:
+        cashflows = {"Senior": result.senior_cf, "Mezz": result.mezz_cf, "Equity": result.equity_cf}[tranche]
+        return ~(irr(cashflows)[0] * 12 * 100 >= target_irr)
+    size = params["senior_size" if tranche == "Senior" else "mezz_size"]
+    shortfall = scheduled_principal(size, result.months, reinvest_toggle) - result.totals[f"{tranche} Principal"]
+    return shortfall > SHORTFALL_TOLERANCE * size
+
+
+def solve_breakeven(deals, variable="default_rate", tranche="Senior", target_irr=None, bounds=None, tol=1e-4,
+                    maxiter=60):
+    # For every row of `deals` (simulate_clo_cashflows inputs, one column each) finds the value of
+    # `variable` at which `tranche` is first impaired: its scheduled principal is no longer paid in full,
+    # or with target_irr (annual %) its IRR falls below the target, which also allows tranche "Equity".
+    # Impairment is assumed monotonic in `variable` over `bounds` (default SOLVER_BOUNDS); each row is
+    # bisected to within `tol`, all rows sharing a horizon advancing together in one summary-only batched
+    # waterfall per step. Returns a frame indexed like `deals` with the breakeven value (the impaired end of
+    # the final bracket), a status and the number of waterfall evaluations.
+    if tranche not in TRANCHES or (tranche == "Equity" and target_irr is None):
+        raise ValueError(f"unknown tranche {tranche!r} for this target")
+    lo_bound, hi_bound = bounds or SOLVER_BOUNDS[variable]
+    deals = with_defaults(deals.copy())
+    out = pd.DataFrame({"Breakeven": np.nan, "Status": NOT_IMPAIRED, "Evaluations": 0}, index=deals.index)
+
+    for (years, reinvest_toggle), group in deals.groupby(["years", "reinvest_toggle"], sort=False):
+        params = {c: group[c].to_numpy(dtype=float) for c in INPUT_COLUMNS[:-2]}
+        n = len(group)
+
+        def impaired(x, rows):
+            trial = {c: v[rows] for c, v in params.items()}
+            trial[variable] = x
+            return _impaired(trial, years, bool(reinvest_toggle), tranche, target_irr)
+
+        everything = np.arange(n)
+        lo = np.full(n, float(lo_bound))
+        hi = np.full(n, float(hi_bound))
+        lo_impaired = impaired(lo, everything)
+        hi_impaired = impaired(hi, everything)
+        evaluations = np.full(n, 2)
+        bracketed = lo_impaired != hi_impaired
+        for _ in range(maxiter):
+            rows = np.flatnonzero(bracketed & (hi - lo > tol))
+            if not len(rows):
+                break
+            mid = (lo[rows] + hi[rows]) / 2
+            # Move whichever end is on the same side of the breakeven as the midpoint.
+            same_as_lo = impaired(mid, rows) == lo_impaired[rows]
+            lo[rows] = np.where(same_as_lo, mid, lo[rows])
+            hi[rows] = np.where(same_as_lo, hi[rows], mid)
+            evaluations[rows] += 1
+
+        breakeven = np.where(hi_impaired, hi, lo)
+        status = np.where(bracketed, CONVERGED, np.where(lo_impaired, IMPAIRED_AT_BOUNDS, NOT_IMPAIRED))
+        # With impairment at both bounds the first impaired value is the bound where the search starts.
+        breakeven = np.where(bracketed, breakeven, np.where(lo_impaired, lo_bound, np.nan))
+        out.loc[group.index, "Breakeven"] = breakeven
+        out.loc[group.index, "Status"] = status
+        out.loc[group.index, "Evaluations"] = evaluations
+    return out
+
+
+def breakeven_table(base, variables=("default_rate", "recovery_rate", "collateral_yield"), tol=1e-4):
+    # Principal-impairment breakevens of the senior and mezz tranches of one deal (a dict of
+    # simulate_clo_cashflows inputs) for each variable, indexed by (variable, tranche).
+    deals = pd.DataFrame([base])
+    rows = {(variable, tranche): solve_breakeven(deals, variable, tranche, tol=tol).iloc[0]
+            for variable in variables for tranche in TRANCHES[:2]}
+    return pd.DataFrame.from_dict(rows, orient="index").rename_axis(["Variable", "Tranche"])
@@ -0,0 +1,58 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from clo_metrics import METRICS
+
+
+def scenario_key(params):
+    # Canonical hash of a dict of deal/assumption inputs: keys are sorted and numbers normalised so that
+    # 110_000_000 and 110000000.0 hash alike.
+    canonical = {k: float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else v
+                 for k, v in params.items()}
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ScenarioCache:
+    # Thread-safe, bounded LRU cache of computed scenarios. A module-level instance is shared by every
+    # Streamlit session in the process.
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                METRICS.incr("cache_hits")
+                return self._entries[key]
+            self.misses += 1
+        METRICS.incr("cache_misses")
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                METRICS.incr("cache_evictions")
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "size": len(self._entries), "maxsize": self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+SCENARIO_CACHE = ScenarioCache()
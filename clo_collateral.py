@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+from clo_periodic_cashflow import CASHFLOW_COLUMNS, CloCashflowResult
+from clo_waterfall import compile_waterfall, run_waterfall, two_tranche_spec
+
+LOAN_COLUMNS = ["balance", "spread", "maturity", "cpr", "cdr"]
+PROJECTION_COLUMNS = ["Interest", "Scheduled Principal", "Prepayments", "Defaults", "Recoveries", "Balance"]
+
+
+class LoanPool:
+    # Loan-level collateral held as one array per attribute (struct-of-arrays): balance ($), spread over
+    # the base rate (annual %), maturity (months from closing), and CPR and CDR (annual %).
+    __slots__ = tuple(LOAN_COLUMNS)
+
+    def __init__(self, balance, spread, maturity, cpr, cdr):
+        arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float)) for x in (
+            balance, spread, maturity, cpr, cdr)])
+        if arrays[0].ndim != 1:
+            raise ValueError("loan attributes must be scalars or one-dimensional arrays")
+        self.balance, self.spread, self.maturity, self.cpr, self.cdr = arrays
+        self.maturity = self.maturity.astype(np.int64)
+
+    @classmethod
+    def from_frame(cls, frame):
+        missing = [c for c in LOAN_COLUMNS if c not in frame]
+        if missing:
+            raise ValueError(f"loan pool is missing columns: {', '.join(missing)}")
+        return cls(*(frame[c].to_numpy() for c in LOAN_COLUMNS))
+
+    def __len__(self):
+        return len(self.balance)
+
+    @property
+    def total_balance(self):
+        return self.balance.sum()
+
+
+class PoolProjection:
+    # Pool-level monthly collections from project_pool, each a (month,) array. balance is the performing
+    # balance at the end of each month.
+    __slots__ = ("months", "interest", "scheduled_principal", "prepayments", "defaults", "recoveries", "balance")
+
+    def __init__(self, months, interest, scheduled_principal, prepayments, defaults, recoveries, balance):
+        self.months = months
+        self.interest = interest
+        self.scheduled_principal = scheduled_principal
+        self.prepayments = prepayments
+        self.defaults = defaults
+        self.recoveries = recoveries
+        self.balance = balance
+
+    @property
+    def principal(self):
+        return self.scheduled_principal + self.prepayments + self.recoveries
+
+    @property
+    def cash(self):
+        # Everything the pool collects in a month: interest plus scheduled, prepaid and recovered principal.
+        return self.interest + self.principal
+
+    def waterfall_inputs(self):
+        # (interest, par, principal) collections in the (month, scenario) layout of clo_waterfall, to run
+        # as run_waterfall(..., cash=interest, interest_collections=interest, par=par,
+        # principal_collections=principal) so that principal proceeds only ever pay down notes.
+        return self.interest[:, None], self.balance[:, None], self.principal[:, None]
+
+    def to_frame(self):
+        df = pd.DataFrame(dict(zip(PROJECTION_COLUMNS, (self.interest, self.scheduled_principal, self.prepayments,
+                                                         self.defaults, self.recoveries, self.balance))))
+        df.index = pd.RangeIndex(1, self.months + 1, name="Month")
+        return df
+
+
+def project_pool(pool, months, base_rate=0.0, recovery_rate=0.0, recovery_lag=0):
+    # Projects every loan over `months` at once as (loan, month) arrays and sums them into pool
+    # collections. Each month a loan first defaults at its monthly default rate (from CDR), then the
+    # survivors pay interest at base_rate + spread and prepay at the monthly rate implied by CPR; whatever
+    # is left is repaid as a bullet in the maturity month. base_rate (annual %) is a scalar or a (month,)
+    # forward curve. Defaults recover recovery_rate % of balance recovery_lag months later; recoveries that
+    # would land after the horizon are dropped.
+    t = np.arange(months)
+    mdr = 1 - (1 - pool.cdr / 100) ** (1 / 12)
+    smm = 1 - (1 - pool.cpr / 100) ** (1 / 12)
+    alive = t < pool.maturity[:, None]
+
+    # Balance at the start of each month: the original balance decays geometrically through defaults and
+    # prepayments, and drops to zero after maturity.
+    opening = np.where(alive, pool.balance[:, None] * ((1 - mdr) * (1 - smm))[:, None] ** t, 0.0)
+    defaults = opening * mdr[:, None]
+    performing = opening - defaults
+    coupon = (np.asarray(base_rate, dtype=float) + pool.spread[:, None]) / 100 / 12
+    interest = (performing * coupon).sum(axis=0)
+    prepayments = performing * smm[:, None]
+    remaining = performing - prepayments
+    scheduled = np.where(t == pool.maturity[:, None] - 1, remaining, 0.0)
+    balance = (remaining - scheduled).sum(axis=0)
+
+    defaults = defaults.sum(axis=0)
+    recoveries = np.zeros(months)
+    if recovery_lag < months:
+        recoveries[recovery_lag:] = defaults[:months - recovery_lag] * (recovery_rate / 100)
+    return PoolProjection(months, interest, scheduled.sum(axis=0), prepayments.sum(axis=0), defaults, recoveries,
+                          balance)
+
+
+def pool_waterfall_spec(reinvest_toggle=False):
+    # The senior/mezz/equity waterfall for a loan-level pool: interest proceeds pay senior then mezz
+    # interest, and principal proceeds (scheduled, prepaid and recovered) retire the senior notes and then
+    # the mezz notes in full before any reaches equity. During the reinvestment period principal is held.
+    spec = two_tranche_spec(reinvest_toggle)
+    for step in spec["steps"]:
+        if step["pay"] == "principal":
+            step["mode"] = "sequential"
+    return spec
+
+
+def run_pool_waterfall(pool, senior_size, mezz_size, equity_size, senior_rate, mezz_rate, years,
+                       reinvest_toggle=False, base_rate=0.0, recovery_rate=0.0, recovery_lag=0, summary_only=False):
+    # pool_waterfall_spec run on a loan-level pool's projected collections, interest and principal kept
+    # in separate accounts. Returns the result in simulate_clo_cashflows' CloCashflowResult layout
+    # (monthly rows dropped with summary_only) and the PoolProjection behind it.
+    months = int(years * 12)
+    projection = project_pool(pool, months, base_rate, recovery_rate, recovery_lag)
+    interest, par, principal = projection.waterfall_inputs()
+    result = run_waterfall(compile_waterfall(pool_waterfall_spec(reinvest_toggle)), [senior_size, mezz_size],
+                           [senior_rate, mezz_rate], equity_size, interest, interest, par, months,
+                           principal_collections=principal)
+    monthly = np.stack([result.interest[0], result.principal[0], result.interest[1], result.principal[1],
+                        result.equity])
+    totals = dict(zip(CASHFLOW_COLUMNS, monthly.sum(axis=1)))
+    senior_cf, mezz_cf, equity_cf = (result.cashflow(name) for name in ("Senior", "Mezz", "Equity"))
+    return CloCashflowResult(months, None if summary_only else monthly, totals, senior_cf, mezz_cf,
+                             equity_cf), projection
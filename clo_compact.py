@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from clo_batch import INPUT_COLUMNS, budget_rows, with_defaults
+from clo_irr import irr
+from clo_metrics import METRICS
+from clo_periodic_cashflow import CASHFLOW_COLUMNS, run_clo_waterfall
+
+# Storage precisions of CompactCashflows:
+#   float64  exact copy of the engine's values.
+#   float32  each stored value within a relative 2**-24 (about 6e-8) of the original: up to $6 on a
+#            $100M monthly payment, and cash-flow totals drift by the same relative amount.
+#   cents    int64 whole cents: each value within $0.005, sums exact in cents; amounts up to about $9e13.
+# The IRRs of stored cash flows move by at most irr_error_bound (to first order). Over random deals in the
+# app's input ranges with IRRs above -100% a year, both compact precisions move IRRs by about 1e-6 IRR
+# points typically and 1e-4 at worst (1e-3 for cents on the smallest cash flows). The bound loosens
+# without limit as an IRR approaches -1200% a year (a monthly rate of -100%).
+PRECISIONS = ("float64", "float32", "cents")
+_DTYPES = {"float64": np.float64, "float32": np.float32, "cents": np.int64}
+# Largest error of one stored value: relative (times the value) for the float precisions, absolute ($)
+# for cents.
+_ERRORS = {"float64": ("relative", 2.0 ** -53), "float32": ("relative", 2.0 ** -24), "cents": ("absolute", 0.005)}
+TRANCHE_COLUMNS = {"Senior": ["Senior Interest", "Senior Principal"], "Mezz": ["Mezz Interest", "Mezz Principal"],
+                   "Equity": ["Equity Cash"]}
+SIZE_COLUMNS = {"Senior": "senior_size", "Mezz": "mezz_size", "Equity": "equity_size"}
+
+
+class CompactCashflows:
+    # Monthly cash flows of many scenarios held column by column, each column one (scenario, month) array
+    # in the chosen precision (see PRECISIONS), optionally memory-mapped from .npy files in `path`.
+    # Scenarios shorter than the longest are zero-padded; `months` holds each one's horizon and `sizes`
+    # its tranche sizes (float64), from which the month-0 purchase of the tranche cash flows is rebuilt.
+    # An `owned` path (a spill directory run_compact created) is deleted by close() or once the object is
+    # garbage collected; a caller's own path is left in place.
+    __slots__ = ("precision", "columns", "months", "sizes", "path", "_cleanup", "__weakref__")
+
+    def __init__(self, precision, columns, months, sizes, path=None, owned=False):
+        self.precision = precision
+        self.columns = columns
+        self.months = months
+        self.sizes = sizes
+        self.path = path
+        self._cleanup = weakref.finalize(self, shutil.rmtree, path, True) if owned else None
+
+    @classmethod
+    def allocate(cls, scenarios, months, precision="float32", path=None, owned=False):
+        # Zeroed storage for `scenarios` rows of up to `months` months, in memory or, with a directory
+        # `path`, in memory-mapped files there that are paged in and out by the OS.
+        _check_precision(precision)
+        shape = (scenarios, months)
+        if path is None:
+            columns = {name: np.zeros(shape, dtype=_DTYPES[precision]) for name in CASHFLOW_COLUMNS}
+        else:
+            os.makedirs(path, exist_ok=True)
+            columns = {name: np.lib.format.open_memmap(
+                os.path.join(path, f"{name.lower().replace(' ', '_')}.npy"), mode="w+",
+                dtype=_DTYPES[precision], shape=shape) for name in CASHFLOW_COLUMNS}
+        sizes = np.zeros((scenarios, len(SIZE_COLUMNS)))
+        return cls(precision, columns, np.zeros(scenarios, dtype=np.int32), sizes, path, owned)
+
+    def __len__(self):
+        return len(self.months)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values()) + self.months.nbytes + self.sizes.nbytes
+
+    def store(self, rows, result, sizes):
+        # Writes a CloCashflowResult (monthly rows kept) for the scenarios at positions `rows`; `sizes` is
+        # their (scenario, tranche) sizes.
+        months = result.months
+        for name in CASHFLOW_COLUMNS:
+            values = result.column(name)
+            if self.precision == "cents":
+                values = np.rint(values * 100)
+            self.columns[name][rows, :months] = values
+        self.months[rows] = months
+        self.sizes[rows] = sizes
+
+    def column(self, name, rows=slice(None)):
+        # Decoded float64 values of one column, (scenario, month).
+        values = np.asarray(self.columns[name][rows], dtype=float)
+        return values / 100 if self.precision == "cents" else values
+
+    def tranche_cashflows(self, tranche, rows=slice(None)):
+        # (scenario, month + 1) cash flows of a tranche, month 0 being the purchase at par.
+        flows = sum(self.column(name, rows) for name in TRANCHE_COLUMNS[tranche])
+        return np.column_stack([-self.sizes[rows, list(SIZE_COLUMNS).index(tranche)], flows])
+
+    def irr(self, rows=slice(None)):
+        # Annualised senior, mezz and equity IRRs in percent, like CloCashflowResult.irr.
+        return tuple(irr(self.tranche_cashflows(tranche, rows))[0] * 12 * 100 for tranche in TRANCHE_COLUMNS)
+
+    def irr_error_bound(self, rows=slice(None)):
+        # Per tranche and scenario, the most the annualised IRR (in points) can differ from that of the
+        # unrounded cash flows, to first order: perturbing flow t by at most e_t moves the NPV by at most
+        # sum(e_t v^t) and the root by that over |NPV'(r)| = |sum(t cf_t v^(t+1))|, with v = 1 / (1 + r)
+        # at the computed IRR. e_t is the storage error of each column making up the tranche (the month-0
+        # purchase is exact). NaN where there is no IRR.
+        kind, unit = _ERRORS[self.precision]
+        bounds = []
+        for tranche, rate in zip(TRANCHE_COLUMNS, self.irr(rows)):
+            cf = self.tranche_cashflows(tranche, rows)
+            periods = np.arange(cf.shape[1])
+            v = 1 / (1 + rate[:, None] / 1200)
+            discount = v ** periods
+            if kind == "relative":
+                error = unit * sum(np.abs(self.column(name, rows)) for name in TRANCHE_COLUMNS[tranche])
+            else:
+                error = np.full(cf[:, 1:].shape, unit * len(TRANCHE_COLUMNS[tranche]))
+            moved = (error * discount[:, 1:]).sum(axis=1)
+            slope = np.abs((periods * cf * discount * v).sum(axis=1))
+            bounds.append(moved / slope * 12 * 100)
+        return tuple(bounds)
+
+    def to_frame(self, scenario=0):
+        # Monthly rows of one scenario in the layout of CloCashflowResult.to_frame.
+        months = int(self.months[scenario])
+        month = np.arange(1, months + 1)
+        df = pd.DataFrame({name: self.column(name, scenario)[:months] for name in CASHFLOW_COLUMNS}, index=month)
+        df.insert(0, "Month", month.astype(float))
+        return df
+
+    def flush(self):
+        for column in self.columns.values():
+            if isinstance(column, np.memmap):
+                column.flush()
+
+    def close(self):
+        # Releases the columns and deletes an owned spill directory; the object is unusable afterwards.
+        self.flush()
+        self.columns = {}
+        if self._cleanup is not None:
+            self._cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _check_precision(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown precision {precision!r}; expected one of {', '.join(PRECISIONS)}")
+
+
+def run_compact(scenarios, precision="float32", memory_budget=None, path=None):
+    # Monthly cash flows of every row of `scenarios` (a frame of simulate_clo_cashflows inputs) as
+    # CompactCashflows, in input order. Rows are simulated in chunks sized to memory_budget (bytes), and
+    # when the stored result would take more than half the budget it is memory-mapped to disk instead of
+    # held in RAM: under `path` if given, else in a new temporary directory that is deleted with the
+    # result (close() it, or use it as a context manager, to do so promptly). Without a budget everything
+    # stays in memory unless `path` is given.
+    _check_precision(precision)
+    scenarios = with_defaults(scenarios.reset_index(drop=True))
+    months = int(scenarios["years"].max() * 12)
+    itemsize = np.dtype(_DTYPES[precision]).itemsize
+    stored_bytes = len(scenarios) * months * len(CASHFLOW_COLUMNS) * itemsize
+    owned = path is None and memory_budget is not None and stored_bytes > memory_budget / 2
+    if owned:
+        path = tempfile.mkdtemp(prefix="clo-compact-")
+        METRICS.incr("compact_spills")
+    out = CompactCashflows.allocate(len(scenarios), months, precision, path, owned)
+
+    for (years, reinvest_toggle), group in scenarios.groupby(["years", "reinvest_toggle"], sort=False):
+        # The other half of the budget is for computing: chunks are sized like monthly batch runs.
+        step = len(group) if memory_budget is None else budget_rows(memory_budget / 2, int(years * 12), True)
+        for start in range(0, len(group), step):
+            chunk = group.iloc[start:start + step]
+            result = run_clo_waterfall(*(chunk[c].to_numpy() for c in INPUT_COLUMNS[:-2]), years=years,
+                                       reinvest_toggle=bool(reinvest_toggle))
+            out.store(chunk.index.to_numpy(), result, chunk[list(SIZE_COLUMNS.values())].to_numpy(dtype=float))
+    out.flush()
+    return out
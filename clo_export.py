@@ -0,0 +1,118 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+EXPORT_FORMATS = ("csv", "parquet", "xlsx")
+# Rows per xlsx sheet, leaving room for the header within Excel's 1,048,576-row limit. Longer tables
+# continue on "<sheet> (2)", "<sheet> (3)", ...
+XLSX_MAX_ROWS = 1_048_575
+
+
+def export_format(path, format=None):
+    fmt = format or os.path.splitext(str(path))[1].lstrip(".").lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unsupported export format {fmt!r}; expected one of {', '.join(EXPORT_FORMATS)}")
+    return fmt
+
+
+class ResultWriter:
+    # Streams DataFrame chunks to CSV, Parquet or xlsx as they arrive, so only one chunk is held in
+    # memory at a time. Chunks go to named tables: an xlsx workbook gets one sheet per table (written with
+    # openpyxl's write-only mode), while CSV and Parquet write the default table to `path` and every other
+    # table to a sibling file "<stem>_<table><ext>". `path` may also be a binary file object, in which case
+    # `format` is required and only the default table can be written (or any table, for xlsx).
+
+    def __init__(self, path, format=None, default_table="Results"):
+        self.path = path
+        self.format = export_format(path, format)
+        self.default_table = default_table
+        self._tables = {}
+        self._workbook = None
+
+    def _table_path(self, table):
+        if table == self.default_table:
+            return self.path
+        if not isinstance(self.path, (str, os.PathLike)):
+            raise ValueError(f"cannot write table {table!r} to a file object in {self.format} format")
+        stem, ext = os.path.splitext(str(self.path))
+        return f"{stem}_{table.lower().replace(' ', '_')}{ext}"
+
+    def write(self, frame, table=None):
+        table = table or self.default_table
+        if self.format == "xlsx":
+            self._write_xlsx(frame, table)
+        elif self.format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            arrow = pa.Table.from_pandas(frame, preserve_index=False)
+            if table not in self._tables:
+                self._tables[table] = pq.ParquetWriter(self._table_path(table), arrow.schema)
+            writer = self._tables[table]
+            writer.write_table(arrow.cast(writer.schema))
+        else:
+            first = table not in self._tables
+            if first:
+                self._tables[table] = self._table_path(table)
+            frame.to_csv(self._tables[table], mode="w" if first else "a", header=first, index=False)
+
+    def _write_xlsx(self, frame, table):
+        if self._workbook is None:
+            from openpyxl import Workbook
+
+            self._workbook = Workbook(write_only=True)
+        state = self._tables.get(table)
+        # Cells are written row by row; NaN has no xlsx representation and is left blank.
+        values = frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+        for row in values:
+            if state is None or state[1] >= XLSX_MAX_ROWS:
+                part = 1 if state is None else state[2] + 1
+                sheet = self._workbook.create_sheet(table if part == 1 else f"{table} ({part})")
+                sheet.append(list(frame.columns))
+                state = [sheet, 0, part]
+                self._tables[table] = state
+            state[0].append(row)
+            state[1] += 1
+        if state is None:
+            sheet = self._workbook.create_sheet(table)
+            sheet.append(list(frame.columns))
+            self._tables[table] = [sheet, 0, 1]
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.save(self.path)
+            self._workbook = None
+        elif self.format == "parquet":
+            for writer in self._tables.values():
+                writer.close()
+        self._tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def scenario_tables(result, annual, irrs, scenario=0):
+    # The tables shown by the CLO view for one run: monthly cash flows (a CloCashflowResult), the annual
+    # summary and the tranche IRRs (annualised %), keyed by table name.
+    irrs = {"Tranche": ["Senior", "Mezzanine", "Equity"],
+            "IRR (%)": [float(np.ravel(x)[scenario]) for x in irrs]}
+    return {"Monthly Cashflows": result.to_frame(scenario), "Annual Summary": annual,
+            "IRRs": pd.DataFrame(irrs)}
+
+
+def export_scenario(path, result, annual, irrs, format=None):
+    # Writes scenario_tables to `path`. Returns the path, or for path=None the exported file as bytes;
+    # with path=None a single-table format (csv, parquet) exports only the monthly cash flows.
+    target = io.BytesIO() if path is None else path
+    tables = scenario_tables(result, annual, irrs)
+    with ResultWriter(target, format, default_table="Monthly Cashflows") as writer:
+        for name, frame in tables.items():
+            if path is None and writer.format != "xlsx" and name != writer.default_table:
+                continue
+            writer.write(frame, name)
+    return target.getvalue() if path is None else path
@@ -0,0 +1,114 @@
+import numpy as np
+
+from clo_metrics import timed
+
+CONVERGED = 0
+NO_ROOT = 1
+MAX_ITER = 2
+
+# Periodic rates at which the NPV is probed to bracket the root closest to zero.
+_IRR_GRID = np.array([-0.99, -0.9, -0.7, -0.5, -0.35, -0.2, -0.1, -0.05, -0.02, -0.01, -0.005, -0.001, -0.0001, 0.0,
+                      0.0001, 0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 100.0])
+
+
+def _horner(coeffs, x):
+    # NPV as a polynomial in the discount factor x = 1 / (1 + r), with its derivative in x
+    p = coeffs[-1].copy()
+    dp = np.zeros_like(x)
+    for t in range(coeffs.shape[0] - 2, -1, -1):
+        dp *= x
+        dp += p
+        p *= x
+        p += coeffs[t]
+    return p, dp
+
+
+def npv(rate, cashflows):
+    # Same convention as numpy_financial.npv (first flow undiscounted), for every row of `cashflows`.
+    cashflows = np.atleast_2d(np.asarray(cashflows, dtype=float))
+    x = np.broadcast_to(1 / (1 + np.asarray(rate, dtype=float)), cashflows.shape[:1]).copy()
+    return _horner(np.ascontiguousarray(cashflows.T), x)[0]
+
+
+@timed("irr")
+def irr(cashflows, guess=None, tol=1e-12, maxiter=100):
+    # Periodic IRR of every row of `cashflows`, returned with a per-row status (CONVERGED, NO_ROOT or
+    # MAX_ITER); rates are NaN wherever the status is not CONVERGED. Without a guess the root nearest
+    # to zero is reported, matching numpy_financial.irr. `guess` (e.g. the rates of a previous, nearby
+    # solve) warm-starts rows whose root lies within a narrow band around it.
+    cashflows = np.atleast_2d(np.asarray(cashflows, dtype=float))
+    n, periods = cashflows.shape
+    rate = np.full(n, np.nan)
+    status = np.full(n, NO_ROOT, dtype=np.int8)
+    coeffs = np.ascontiguousarray(cashflows.T)
+
+    rows = np.empty(0, dtype=np.intp)
+    lo = hi = f_lo = f_hi = np.empty(0)
+    pending = np.arange(n)
+    if guess is not None:
+        guess = np.broadcast_to(np.asarray(guess, dtype=float), (n,))
+        warm = np.flatnonzero(np.isfinite(guess) & (guess > -0.99))
+        band = 0.01 * (1 + np.abs(guess[warm]))
+        hi = 1 / (1 + np.maximum(guess[warm] - band, -0.99))
+        lo = 1 / (1 + guess[warm] + band)
+        f_hi = _horner(coeffs[:, warm], hi.copy())[0]
+        f_lo = _horner(coeffs[:, warm], lo.copy())[0]
+        found = f_lo * f_hi < 0
+        rows, lo, hi, f_lo, f_hi = warm[found], lo[found], hi[found], f_lo[found], f_hi[found]
+        pending = np.setdiff1d(pending, rows)
+
+    if len(pending):
+        # Bracket: evaluate the NPV on a grid of rates (one matrix product) and keep the sign change
+        # nearest to r = 0, which is the root numpy_financial.irr reports.
+        flows = cashflows[pending]
+        grid = _IRR_GRID[periods * np.log10(1 / (1 + _IRR_GRID)) < 300]
+        x_grid = 1 / (1 + grid)
+        with np.errstate(over="ignore", invalid="ignore"):
+            grid_npv = flows @ (x_grid[None, :] ** np.arange(periods)[:, None])
+        sign = np.sign(grid_npv)
+        change = sign[:, :-1] * sign[:, 1:] < 0
+        distance = np.abs(grid[:-1]) + np.abs(grid[1:])
+        pick = np.argmin(np.where(change, distance, np.inf), axis=1)
+        bracketed = np.flatnonzero(change[np.arange(len(pending)), pick])
+
+        # Flows whose NPV vanishes exactly on a grid rate (e.g. a zero IRR) need no search.
+        exact = (grid_npv == 0) & np.any(flows != 0, axis=1)[:, None]
+        hit = np.flatnonzero(exact.any(axis=1))
+        rate[pending[hit]] = grid[np.argmin(np.where(exact[hit], np.abs(grid), np.inf), axis=1)]
+        status[pending[hit]] = CONVERGED
+        bracketed = np.setdiff1d(bracketed, hit)
+
+        k = pick[bracketed]
+        rows = np.concatenate([rows, pending[bracketed]])
+        hi = np.concatenate([hi, x_grid[k]])
+        lo = np.concatenate([lo, x_grid[k + 1]])
+        f_hi = np.concatenate([f_hi, grid_npv[bracketed, k]])
+        f_lo = np.concatenate([f_lo, grid_npv[bracketed, k + 1]])
+
+    # Safeguarded Newton on x, started from the secant point of the bracket; steps leaving the
+    # bracket become bisections. Only unsettled rows are carried forward, and the coefficient
+    # matrix is compacted once most of its columns have settled.
+    col = rows
+    sign_lo = np.sign(f_lo)
+    x = lo + (hi - lo) * f_lo / (f_lo - f_hi)
+    for _ in range(maxiter):
+        if len(rows) == 0:
+            break
+        if len(col) < coeffs.shape[1] // 2:
+            coeffs = coeffs[:, col]
+            col = np.arange(len(col))
+        p, dp = _horner(coeffs if len(col) == coeffs.shape[1] else coeffs[:, col], x)
+        left = np.sign(p) == sign_lo
+        lo = np.where(left, x, lo)
+        hi = np.where(left, hi, x)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = p / dp
+        x_new = x - step
+        x_new = np.where((x_new > lo) & (x_new < hi), x_new, 0.5 * (lo + hi))
+        done = (np.abs(step) <= tol * x) | (hi - lo <= tol * x) | (p == 0)
+        rate[rows[done]] = 1 / x[done] - 1
+        status[rows[done]] = CONVERGED
+        keep = ~done
+        rows, col, x, lo, hi, sign_lo = rows[keep], col[keep], x_new[keep], lo[keep], hi[keep], sign_lo[keep]
+    status[rows] = MAX_ITER
+    return rate, status
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from clo_batch import run_scenario_frame
+from clo_metrics import METRICS
+from clo_periodic_cashflow import ENGINE_VERSION
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+# Returned by JobRunner.cancel when the caller stopped watching but others keep the job running.
+WITHDRAWN = "withdrawn"
+
+
+def job_key(scenarios):
+    # Content hash of a scenario frame (values, columns and engine version), used as the job id so identical
+    # submissions share one job.
+    digest = hashlib.sha256(f"{ENGINE_VERSION}|{'|'.join(map(str, scenarios.columns))}|".encode())
+    digest.update(pd.util.hash_pandas_object(scenarios, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+class Job:
+    # State of one submitted batch. `chunks` holds the result frames completed so far, in input order, and
+    # `watchers` the ids of the submitters still interested in it.
+    __slots__ = ("id", "total", "done", "status", "error", "chunks", "watchers", "cancel_event", "future",
+                 "submitted", "started", "finished")
+
+    def __init__(self, job_id, total, watcher):
+        self.id = job_id
+        self.total = total
+        self.done = 0
+        self.status = QUEUED
+        self.error = None
+        self.chunks = []
+        self.watchers = {watcher}
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+
+class JobRunner:
+    # Runs scenario batches in the background. At most max_jobs jobs run at once (later submissions queue);
+    # each job feeds its chunks through run_scenario_frame in its own thread, or in a shared process pool of
+    # `processes` workers. Submitting a frame identical to a queued or running job joins that job instead
+    # of starting another; each watcher (e.g. a session id) counts once however often it submits, and the
+    # job only stops once every watcher has cancelled. Finished jobs are kept (results included) until `keep` newer ones have
+    # finished. Thread-safe; a module-level instance is shared by every Streamlit session in the process.
+
+    def __init__(self, max_jobs=2, chunksize=10_000, processes=0, keep=16):
+        self.chunksize = chunksize
+        self.keep = keep
+        self._threads = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="clo-job")
+        self._processes = ProcessPoolExecutor(max_workers=processes) if processes else None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, scenarios, watcher=None):
+        # Queues `scenarios` (a frame of run_scenario_frame inputs) on behalf of `watcher` and returns its
+        # job id. Without a watcher every submission counts as a separate one.
+        watcher = object() if watcher is None else watcher
+        scenarios = scenarios.reset_index(drop=True)
+        job_id = job_key(scenarios)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status not in (CANCELLED, FAILED) and not job.cancel_event.is_set():
+                job.watchers.add(watcher)
+                METRICS.incr("job_dedup_hits")
+                return job_id
+            job = Job(job_id, len(scenarios), watcher)
+            self._jobs[job_id] = job
+            self._jobs.move_to_end(job_id)
+            job.future = self._threads.submit(self._run, job, scenarios)
+            METRICS.incr("jobs_submitted")
+        return job_id
+
+    def _run(self, job, scenarios):
+        with self._lock:
+            if job.cancel_event.is_set():
+                return
+            job.status = RUNNING
+            job.started = time.time()
+        try:
+            with METRICS.span("job"):
+                for start in range(0, len(scenarios), self.chunksize):
+                    if job.cancel_event.is_set():
+                        break
+                    chunk = scenarios.iloc[start:start + self.chunksize]
+                    if self._processes is None:
+                        frame = run_scenario_frame(chunk)
+                    else:
+                        frame = self._processes.submit(run_scenario_frame, chunk).result()
+                    frame.index = chunk.index
+                    with self._lock:
+                        job.chunks.append(frame)
+                        job.done += len(frame)
+        except Exception as exc:
+            with self._lock:
+                job.status, job.error = FAILED, f"{type(exc).__name__}: {exc}"
+        else:
+            with self._lock:
+                job.status = CANCELLED if job.cancel_event.is_set() else DONE
+        finally:
+            with self._lock:
+                job.finished = time.time()
+                self._prune()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in (DONE, CANCELLED, FAILED)]
+        for job_id in finished[:max(len(finished) - self.keep, 0)]:
+            del self._jobs[job_id]
+
+    def status(self, job_id):
+        # Progress of a job as a dict, or None for an unknown (or pruned) job id.
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            end = job.finished or time.time()
+            return {"id": job.id, "status": job.status, "done": job.done, "total": job.total,
+                    "progress": job.done / job.total if job.total else 1.0, "error": job.error,
+                    "elapsed_s": end - job.started if job.started else 0.0, "watchers": len(job.watchers)}
+
+    def results(self, job_id):
+        # Results computed so far, in input order (partial while the job is running).
+        with self._lock:
+            job = self._jobs.get(job_id)
+            chunks = list(job.chunks) if job is not None else []
+        return pd.concat(chunks) if chunks else pd.DataFrame()
+
+    def cancel(self, job_id, watcher=None):
+        # Withdraws `watcher`'s interest in the job (any one watcher when None). Returns CANCELLED when
+        # that stopped the job, WITHDRAWN when other watchers keep it running, and None when the job is
+        # unknown, already finished or not watched by `watcher`. A running job stops after its current
+        # chunk and keeps its partial results.
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in (QUEUED, RUNNING):
+                return None
+            if watcher is None:
+                job.watchers.pop()
+            elif watcher in job.watchers:
+                job.watchers.remove(watcher)
+            else:
+                return None
+            if job.watchers:
+                return WITHDRAWN
+            job.cancel_event.set()
+            if job.future.cancel():
+                job.status = CANCELLED
+                job.finished = time.time()
+            METRICS.incr("jobs_cancelled")
+            return CANCELLED
+
+    def jobs(self):
+        with self._lock:
+            job_ids = list(self._jobs)
+        return [self.status(job_id) for job_id in job_ids]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel_event.set()
+        self._threads.shutdown(wait=wait, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=wait, cancel_futures=True)
+
+
+# Bounded per server process: CLO_JOB_CONCURRENCY jobs at once, CLO_JOB_PROCESSES worker processes (0 runs
+# jobs in threads).
+JOB_RUNNER = JobRunner(max_jobs=int(os.environ.get("CLO_JOB_CONCURRENCY", 2)),
+                       processes=int(os.environ.get("CLO_JOB_PROCESSES", 0)))
@@ -0,0 +1,114 @@
+import functools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import nullcontext
+
+# Returned by span() while metrics are disabled, so an uninstrumented run only pays for one attribute
+# check per span.
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    # Process-wide timing spans and counters for the model's hot paths. Disabled by default (set
+    # CLO_METRICS=1, pass enabled=True or toggle .enabled); while disabled, span() and incr() return
+    # immediately. Spans keep count, total, max and last duration per name.
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._counters = {}
+
+    def span(self, name):
+        return _Span(self, name) if self.enabled else _NULL_SPAN
+
+    def record(self, name, seconds):
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                self._spans[name] = [1, seconds, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+                stats[3] = seconds
+
+    def incr(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def snapshot(self):
+        # {"spans": {name: {count, total_s, mean_s, max_s, last_s}}, "counters": {name: value}}
+        with self._lock:
+            spans = {name: {"count": count, "total_s": total, "mean_s": total / count, "max_s": peak,
+                            "last_s": last}
+                     for name, (count, total, peak, last) in self._spans.items()}
+            return {"spans": spans, "counters": dict(self._counters)}
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix="clo"):
+        # Prometheus text exposition format: a summary per span (count and sum) plus a max gauge, and one
+        # counter per counter name.
+        snapshot = self.snapshot()
+        lines = [f"# TYPE {prefix}_span_seconds summary"]
+        for name, stats in sorted(snapshot["spans"].items()):
+            lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {stats["count"]}')
+            lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {stats["total_s"]:.9f}')
+        lines.append(f"# TYPE {prefix}_span_seconds_max gauge")
+        for name, stats in sorted(snapshot["spans"].items()):
+            lines.append(f'{prefix}_span_seconds_max{{span="{name}"}} {stats["max_s"]:.9f}')
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        # Writes the metrics as Prometheus text for .prom/.txt paths and as JSON otherwise.
+        with open(path, "w") as f:
+            f.write(self.to_prometheus() if path.endswith((".prom", ".txt")) else self.to_json())
+
+
+METRICS = Metrics(enabled=os.environ.get("CLO_METRICS", "") not in ("", "0"))
+
+
+def timed(name):
+    # Decorator recording every call of the function as span `name` while METRICS is enabled.
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return fn(*args, **kwargs)
+            with _Span(METRICS, name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
@@ -1,9 +1,44 @@
+import uuid
+
 import streamlit as st
-import plotly.graph_objects as go
-import numpy_financial as npf
+import numpy as np
 import pandas as pd
 
-
+from clo_breakeven import CONVERGED, NOT_IMPAIRED, SOLVER_BOUNDS, breakeven_table, solve_breakeven
+from clo_cache import SCENARIO_CACHE, scenario_key
+from clo_export import export_scenario
+from clo_irr import irr
+from clo_jobs import DONE, JOB_RUNNER, QUEUED, RUNNING, WITHDRAWN
+from clo_metrics import METRICS, timed
+from clo_periodic_cashflow import CASHFLOW_COLUMNS, STRESS_SCENARIOS, CloCashflowResult, run_clo_waterfall
+from clo_sensitivity import sensitivity_grid
+from clo_store import default_store, stored_key
+
+SENSITIVITY_LABELS = {
+    "default_rate": "Default Rate (%)",
+    "recovery_rate": "Recovery Rate (%)",
+    "collateral_yield": "Collateral Yield (%)",
+    "senior_rate": "Senior Coupon (%)",
+    "mezz_rate": "Mezz Coupon (%)",
+}
+# Heatmap axis ranges, matching the sidebar input bounds.
+SENSITIVITY_RANGES = {
+    "default_rate": (0.0, 40.0),
+    "recovery_rate": (0.0, 100.0),
+    "collateral_yield": (5.0, 20.0),
+    "senior_rate": (1.0, 10.0),
+    "mezz_rate": (1.0, 15.0),
+}
+# Tranche View geometry, in the chart's y units.
+TRANCHE_BAR_HEIGHT = 0.9
+TRANCHE_BAR_GAP = 0.3
+# Rows per page of the monthly cash-flow tables; longer horizons are paged server-side.
+MONTHLY_PAGE_SIZE = 60
+MONTHLY_LABELS = {"Mezz Interest": "Mezzanine Interest", "Mezz Principal": "Mezzanine Principal"}
+ANNUAL_CASHFLOW_COLUMNS = ["Senior Cash Flow", "Mezzanine Cash Flow", "Equity Cash Flow"]
+
+
+@timed("annual_summary")
 def create_clo_annual_cashflow_summary(df, years):
     df["Year"] = (df["Month"] - 1) // 12 + 1
     summary = df.groupby("Year")[
@@ -15,6 +50,393 @@ def create_clo_annual_cashflow_summary(df, years):
     return summary[["Year Label", "Senior Cash Flow", "Mezzanine Cash Flow", "Equity Cash Flow"]]
 
 
+def simulate_scenario(total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+                      default_rate, recovery_rate, collateral_yield, years, reinvest_toggle):
+    # Simulation, annual summary and simplified IRRs for one set of inputs, memoised in SCENARIO_CACHE so
+    # reruns that only change the chart view or display options are cache hits, and persisted in the
+    # on-disk result store when CLO_RESULT_STORE is set. Cached values are shared between sessions and
+    # must not be mutated.
+    params = dict(total_collateral=total_collateral, senior_size=senior_size, mezz_size=mezz_size,
+                  equity_size=equity_size, senior_rate=senior_rate, mezz_rate=mezz_rate,
+                  default_rate=default_rate, recovery_rate=recovery_rate, collateral_yield=collateral_yield,
+                  years=years, reinvest_toggle=reinvest_toggle)
+    return SCENARIO_CACHE.get_or_compute(scenario_key(params), lambda: _load_or_simulate(params))
+
+
+def _load_or_simulate(params):
+    store = default_store()
+    if store is None:
+        return _simulate_scenario(**params)
+    key = stored_key(params)
+    arrays = store.get_arrays(key)
+    if arrays is not None:
+        return _scenario_from_arrays(arrays, params["years"])
+    scenario = _simulate_scenario(**params)
+    result = scenario["result"]
+    store.put_arrays(key, {"monthly": result.monthly, "senior_cf": result.senior_cf, "mezz_cf": result.mezz_cf,
+                           "equity_cf": result.equity_cf, "irr": np.array(scenario["irr"])})
+    return scenario
+
+
+def _scenario_from_arrays(arrays, years):
+    # Rebuilds a _simulate_scenario value from the arrays the store keeps; the totals and annual summary
+    # are derived from the monthly rows exactly as the engine derives them.
+    monthly = arrays["monthly"]
+    result = CloCashflowResult(monthly.shape[1], monthly, dict(zip(CASHFLOW_COLUMNS, monthly.sum(axis=1))),
+                               arrays["senior_cf"], arrays["mezz_cf"], arrays["equity_cf"])
+    return {
+        "result": result,
+        "annual": create_clo_annual_cashflow_summary(result.to_frame(), years),
+        "irr": tuple(arrays["irr"]),
+    }
+
+
+def _simulate_scenario(total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+                       default_rate, recovery_rate, collateral_yield, years, reinvest_toggle):
+    result = run_clo_waterfall(total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+                               default_rate, recovery_rate, collateral_yield, years, reinvest_toggle)
+    df = result.to_frame()
+
+    senior_paid = df["Senior Interest"].sum() + df["Senior Principal"].sum()
+    mezz_paid = df["Mezz Interest"].sum() + df["Mezz Principal"].sum()
+    equity_paid = df["Equity Cash"].sum()
+
+    # IRR Calculations
+    senior_cf = [-senior_size] + [senior_paid / years] * (years - 1) + [senior_paid / years + senior_size]
+    mezz_cf = [-mezz_size] + [mezz_paid / years] * (years - 1) + [mezz_paid / years + mezz_size]
+    equity_cf = [-equity_size] + [equity_paid / years] * years
+
+    return {
+        "result": result,
+        "annual": create_clo_annual_cashflow_summary(df, years),
+        "irr": tuple(irr([senior_cf, mezz_cf, equity_cf])[0] * 100),
+    }
+
+
+def status_flag(actual, expected):
+    if actual >= expected:
+        return "✅"
+    elif actual > 0:
+        return "⚠️"
+    else:
+        return "❌"
+
+
+def cached_figure(base, view, build, **options):
+    # Figure for one chart view of the inputs `base`, built once per result and display options and kept
+    # in SCENARIO_CACHE. Like the cached scenarios, the returned figure is shared and must not be mutated.
+    key = scenario_key(dict(base, figure=view, **options))
+    return SCENARIO_CACHE.get_or_compute(key, build)
+
+
+def tranche_figure(tranches, total_collateral):
+    # Tranche View: one bar per tranche, filled up to its share of the expected payment, fed by the loan
+    # pool. Every element kind (filled and unfilled segments, arrows, labels) is a single array-valued
+    # trace, so the figure stays a handful of objects instead of shapes and annotations per tranche.
+    import plotly.graph_objects as go
+
+    n = len(tranches)
+    paid = np.array([tranche["paid"] for tranche in tranches])
+    expected = np.array([tranche["expected"] for tranche in tranches])
+    y_base = np.arange(n) * (TRANCHE_BAR_HEIGHT + TRANCHE_BAR_GAP)
+    filled = TRANCHE_BAR_HEIGHT * np.minimum(paid / expected, 1.0)
+    centre = y_base + TRANCHE_BAR_HEIGHT / 2
+    top = n * (TRANCHE_BAR_HEIGHT + TRANCHE_BAR_GAP) - TRANCHE_BAR_GAP
+    unpaid = filled < TRANCHE_BAR_HEIGHT
+    labels = [f"<b>{tranche['label']}</b> {status_flag(tranche['paid'], tranche['expected'])}"
+              f"<br>${tranche['paid']:,.0f}" for tranche in tranches]
+
+    fig = go.Figure([
+        go.Bar(x=[0.075], y=[top], base=[0], width=[0.15], marker=dict(
+            color="rgba(180,220,255,0.6)", line=dict(color="black", width=1))),
+        go.Bar(x=np.full(n, 0.5), y=filled, base=y_base, width=0.4, marker=dict(
+            color=[tranche["color"] for tranche in tranches], line=dict(color="black", width=1))),
+        go.Bar(x=np.full(unpaid.sum(), 0.5), y=(TRANCHE_BAR_HEIGHT - filled)[unpaid],
+               base=(y_base + filled)[unpaid], width=0.4, marker=dict(
+                color="rgba(230,230,230,0.3)", line=dict(color="gray", width=0.5))),
+        # Arrows from the pool to each bar: one line segment per tranche, separated by gaps (None), with
+        # an arrowhead marker only at the segment's end.
+        go.Scatter(x=np.tile([0.15, 0.3, None], n), y=np.repeat(centre, 3), mode="lines+markers",
+                   line=dict(color="gray", width=2),
+                   marker=dict(symbol="arrow", angleref="previous", size=np.tile([0, 10, 0], n), color="gray")),
+        go.Scatter(x=np.full(n, 0.75), y=centre, text=labels, mode="text", textposition="middle right",
+                   textfont=dict(size=14, color="black", family="Helvetica")),
+        go.Scatter(x=[0.075], y=[top / 2], text=[f"<b>Loan Pool</b><br>${total_collateral:,.0f}"], mode="text",
+                   textfont=dict(size=13, color="black")),
+    ])
+    fig.update_traces(hoverinfo="skip")
+    fig.update_layout(
+        autosize=True,
+        height=750,
+        margin=dict(t=50, l=40, r=40, b=50),
+        xaxis=dict(range=[0, 1], visible=False),
+        yaxis=dict(range=[0, top + TRANCHE_BAR_GAP + 1], visible=False),
+        title="",
+        barmode="overlay",
+        showlegend=False,
+        plot_bgcolor="rgba(0,0,0,0)"
+    )
+    return fig
+
+
+def waterfall_figure(x_labels, y_values, text_labels, hover_text, available_cash):
+    import plotly.graph_objects as go
+
+    fig = go.Figure(go.Waterfall(
+        name="CLO Waterfall",
+        orientation="v",
+        measure=["relative"] * len(x_labels),
+        x=x_labels,
+        y=y_values,
+        text=text_labels,
+        textposition="inside",
+        texttemplate="%{text}",
+        insidetextfont=dict(color="white", size=14, family="Helvetica"),
+        hovertext=hover_text,
+        hoverinfo="text",
+        connector={"line": {"color": "#666", "width": 1.5}},
+        decreasing={"marker": {"color": "#003366"}},
+        increasing={"marker": {"color": "#cc0000"}},
+        totals={"marker": {"color": "#27a119"}},
+        opacity=0.85
+    ))
+
+    fig.update_layout(
+        title="",
+        showlegend=False,
+        xaxis=dict(
+            title=dict(text="Cash Flow Step", font=dict(color="black", size=14)),
+            tickfont=dict(color="black")
+        ),
+        yaxis=dict(
+            title=dict(text="Amount ($)", font=dict(color="black", size=14)),
+            tickfont=dict(color="black"),
+            range=[-available_cash * 1.05, available_cash * 1.05]
+        ),
+        margin=dict(t=50, l=80, r=80, b=120),
+        autosize=True,
+        height=750,
+        transition_duration=500
+    )
+    return fig
+
+
+def render_tranche_summary(totals, expected_loss):
+    net_cash = sum(totals[name] for name in CASHFLOW_COLUMNS)
+    st.subheader("Tranche Summary")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Senior Interest", f"${totals['Senior Interest'] / 1_000_000:.2f}M")
+        st.metric("Senior Principal", f"${totals['Senior Principal'] / 1_000_000:.2f}M")
+    with col2:
+        st.metric("Mezzanine Interest", f"${totals['Mezz Interest'] / 1_000_000:.2f}M")
+        st.metric("Mezzanine Principal", f"${totals['Mezz Principal'] / 1_000_000:.2f}M")
+    with col3:
+        st.metric("Equity Residual", f"${totals['Equity Cash'] / 1_000_000:.2f}M")
+        st.metric("Expected Loss", f"${expected_loss / 1_000_000:.2f}M")
+        st.metric("Net Cash Distributed", f"${net_cash / 1_000_000:.2f}M")
+
+
+def render_annual_table(annual):
+    # Amounts are scaled to millions in one vectorised step and formatted by the table itself, rather
+    # than turned into strings cell by cell.
+    table = annual.assign(**{col: annual[col] / 1_000_000 for col in ANNUAL_CASHFLOW_COLUMNS})
+    money = st.column_config.NumberColumn(format="$%.2fM")
+    with METRICS.span("render_tables"):
+        st.dataframe(table, use_container_width=True, column_config=dict.fromkeys(ANNUAL_CASHFLOW_COLUMNS, money))
+
+
+def render_monthly_table(result, key):
+    # Only the selected page of months is built and sent to the browser, whatever the horizon.
+    pages = -(-result.months // MONTHLY_PAGE_SIZE)
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages}, {MONTHLY_PAGE_SIZE} months each)", 1, pages, 1, key=key)
+    start = (page - 1) * MONTHLY_PAGE_SIZE
+    table = result.to_frame(start=start, stop=start + MONTHLY_PAGE_SIZE).rename(columns=MONTHLY_LABELS)
+    with METRICS.span("render_tables"):
+        st.dataframe(table, use_container_width=True)
+
+
+def sensitivity_cube(base, x, y, steps=21):
+    # Two-axis sensitivity grid around the current inputs, cached alongside the scenario results.
+    axes = {name: np.linspace(*SENSITIVITY_RANGES[name], steps) for name in (x, y)}
+    key = scenario_key(dict(base, heatmap_x=x, heatmap_y=y, heatmap_steps=steps))
+    return SCENARIO_CACHE.get_or_compute(key, lambda: sensitivity_grid(base, axes))
+
+
+def render_sensitivity_heatmap(base):
+    col1, col2, col3 = st.columns(3)
+    params = list(SENSITIVITY_LABELS)
+    x = col1.selectbox("X Axis", params, index=0, format_func=SENSITIVITY_LABELS.get)
+    y = col2.selectbox("Y Axis", [p for p in params if p != x], index=0, format_func=SENSITIVITY_LABELS.get)
+    metric = col3.selectbox("Metric", ["Senior IRR", "Mezz IRR", "Equity IRR"], index=2)
+
+    table = sensitivity_cube(base, x, y).heatmap(metric, x, y)
+    import plotly.graph_objects as go
+
+    with METRICS.span("heatmap_figure"):
+        fig = go.Figure(go.Heatmap(
+            z=table.values,
+            x=table.columns,
+            y=table.index,
+            colorscale="RdYlGn",
+            colorbar=dict(title=dict(text=f"{metric} (%)")),
+            hovertemplate=f"{SENSITIVITY_LABELS[x]}: %{{x:.1f}}<br>{SENSITIVITY_LABELS[y]}: %{{y:.1f}}"
+                          f"<br>{metric}: %{{z:.2f}}%<extra></extra>",
+        ))
+        fig.add_trace(go.Scatter(x=[base[x]], y=[base[y]], mode="markers", showlegend=False, hoverinfo="skip",
+                                 marker=dict(symbol="x", size=14, color="black")))
+        fig.update_layout(
+            height=650,
+            margin=dict(t=50, l=80, r=80, b=80),
+            xaxis=dict(title=dict(text=SENSITIVITY_LABELS[x])),
+            yaxis=dict(title=dict(text=SENSITIVITY_LABELS[y])),
+        )
+    with METRICS.span("render_chart"):
+        st.plotly_chart(fig, use_container_width=True)
+    st.caption("The cross marks the current inputs. Other inputs are held at their sidebar values.")
+
+
+def stress_sweep_scenarios(base, steps):
+    # Full grid of default rate x recovery rate x collateral yield over the sidebar input ranges, every
+    # other input held at its sidebar value.
+    names = ["default_rate", "recovery_rate", "collateral_yield"]
+    mesh = np.meshgrid(*(np.linspace(*SENSITIVITY_RANGES[name], steps) for name in names), indexing="ij")
+    frame = pd.DataFrame({name: m.ravel() for name, m in zip(names, mesh)})
+    for name, value in base.items():
+        if name not in names:
+            frame[name] = value
+    return frame
+
+
+def render_stress_sweep(base):
+    # Runs a large grid in the shared background JobRunner so the page stays responsive; the progress
+    # fragment polls the job every second while it is queued or running.
+    steps = st.slider("Grid Points per Axis", 5, 60, 30,
+                      help="Default rate, recovery rate and collateral yield are each swept over their full range.")
+    st.caption(f"{steps ** 3:,} scenarios")
+    col1, col2 = st.columns(2)
+    # The session watches at most one sweep: a new submission withdraws it from the one it replaces.
+    watcher = st.session_state.setdefault("job_watcher", uuid.uuid4().hex)
+    if col1.button("Run in Background"):
+        previous = st.session_state.get("sweep_job")
+        st.session_state["sweep_job"] = JOB_RUNNER.submit(stress_sweep_scenarios(base, steps), watcher)
+        if previous is not None and previous != st.session_state["sweep_job"]:
+            JOB_RUNNER.cancel(previous, watcher)
+    job_id = st.session_state.get("sweep_job")
+    if job_id is None:
+        return
+    status = JOB_RUNNER.status(job_id)
+    if status is not None and status["status"] in (QUEUED, RUNNING) and col2.button("Cancel"):
+        if JOB_RUNNER.cancel(job_id, watcher) == WITHDRAWN:
+            st.session_state["sweep_job"] = None
+            st.info("Other sessions are waiting on this sweep, so it keeps running; this session has stopped "
+                    "following it.")
+            return
+        status = JOB_RUNNER.status(job_id)
+    active = status is not None and status["status"] in (QUEUED, RUNNING)
+    st.fragment(_render_sweep_progress, run_every=1.0 if active else None)(job_id, active)
+
+
+def _render_sweep_progress(job_id, was_active):
+    status = JOB_RUNNER.status(job_id)
+    if status is None:
+        st.info("This sweep has expired; run it again.")
+        return
+    st.progress(status["progress"], text=f"Job {job_id}: {status['status']}, {status['done']:,} of "
+                                         f"{status['total']:,} scenarios ({status['elapsed_s']:.1f} s)")
+    if status["error"]:
+        st.error(status["error"])
+    results = JOB_RUNNER.results(job_id)
+    if len(results):
+        metrics = ["Senior IRR", "Mezz IRR", "Equity IRR"]
+        summary = results[metrics].quantile([0.01, 0.05, 0.5, 0.95, 0.99]).T
+        summary.columns = ["P1", "P5", "Median", "P95", "P99"]
+        # A tranche is impaired when it earns less than its coupon (equity: less than zero) or has no IRR.
+        hurdles = [results["senior_rate"], results["mezz_rate"], 0.0]
+        summary.insert(0, "Impaired (%)", [(~(results[m] >= h)).mean() * 100 for m, h in zip(metrics, hurdles)])
+        st.dataframe(summary.round(2), use_container_width=True)
+        if status["status"] == DONE:
+            st.download_button("Download Results (.csv)", lambda: results.to_csv(index=False),
+                               file_name=f"clo_sweep_{job_id}.csv", mime="text/csv", on_click="ignore")
+    if was_active and status["status"] not in (QUEUED, RUNNING):
+        # Rerun the whole page so the fragment stops polling.
+        st.rerun()
+
+
+def render_breakeven_solver(base):
+    st.subheader("Principal Impairment Breakevens")
+    st.caption("The value of each input at which the tranche first misses scheduled principal, with every "
+               "other input held at its sidebar value.")
+    key = scenario_key(dict(base, view="breakevens"))
+    table = SCENARIO_CACHE.get_or_compute(key, lambda: breakeven_table(base))
+    breakevens = table["Breakeven"].unstack("Tranche").reindex(table.index.unique("Variable"))
+    breakevens = breakevens.rename(index=SENSITIVITY_LABELS, columns={"Mezz": "Mezzanine"})
+    st.dataframe(breakevens.round(2), use_container_width=True)
+    if (table["Status"] != CONVERGED).any():
+        st.caption("Blank: not impaired anywhere in the search range. 0 or the range start: impaired throughout.")
+
+    st.subheader("Target IRR")
+    col1, col2, col3 = st.columns(3)
+    tranche = col1.selectbox("Tranche", ["Senior", "Mezz", "Equity"], index=2,
+                             format_func=lambda t: "Mezzanine" if t == "Mezz" else t)
+    variable = col2.selectbox("Solve For", list(SENSITIVITY_LABELS), format_func=SENSITIVITY_LABELS.get)
+    target = col3.number_input("Target IRR (%)", -50.0, 100.0, 10.0, step=0.5)
+    solved = solve_breakeven(pd.DataFrame([base]), variable, tranche, target_irr=target).iloc[0]
+    label = SENSITIVITY_LABELS[variable]
+    if solved["Status"] == CONVERGED:
+        st.metric(f"{label} at which IRR reaches {target:.2f}%", f"{solved['Breakeven']:.2f}",
+                  help=f"{solved['Evaluations']} batched waterfall evaluations")
+    else:
+        low, high = SOLVER_BOUNDS[variable]
+        st.info(f"The IRR target is {'met' if solved['Status'] == NOT_IMPAIRED else 'missed'} "
+                f"for every {label.lower()} between {low:g} and {high:g}.")
+
+
+def render_export(scenario):
+    # Download of the current run. The file is only built when the button is clicked.
+    st.subheader("Export")
+    formats = {"xlsx": "Excel workbook (monthly, annual, IRRs)", "parquet": "Parquet (monthly cash flows)"}
+    col1, col2 = st.columns([2, 1])
+    fmt = col1.selectbox("Export Format", list(formats), format_func=formats.get)
+    col2.download_button(
+        f"Download .{fmt}",
+        data=lambda: export_scenario(None, scenario["result"], scenario["annual"], scenario["irr"], format=fmt),
+        file_name=f"clo_cashflows.{fmt}",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if fmt == "xlsx"
+        else "application/octet-stream",
+        on_click="ignore",
+    )
+
+
+def render_profiling_panel():
+    # Per-stage latencies and counters from the process-wide METRICS, which every session shares. "page"
+    # is the previous run, since the current one is still in progress. Sessions only read the metrics;
+    # whether they are collected is decided for the whole server by CLO_METRICS.
+    snapshot = METRICS.snapshot()
+    with st.sidebar:
+        st.header("Profiling")
+        if not METRICS.enabled:
+            st.info("Metrics collection is off. Restart the app with CLO_METRICS=1 to record timings and counters.")
+            return
+        spans = pd.DataFrame.from_dict(snapshot["spans"], orient="index")
+        if len(spans):
+            table = (spans[["last_s", "mean_s", "max_s"]] * 1000).round(2)
+            table.columns = ["Last (ms)", "Mean (ms)", "Max (ms)"]
+            table["Calls"] = spans["count"]
+            st.dataframe(table.sort_values("Last (ms)", ascending=False), use_container_width=True)
+        st.dataframe(pd.Series(snapshot["counters"], name="Count", dtype="int64"), use_container_width=True)
+        col1, col2 = st.columns(2)
+        col1.download_button("JSON", METRICS.to_json(), file_name="clo_metrics.json", mime="application/json",
+                             on_click="ignore")
+        col2.download_button("Prometheus", METRICS.to_prometheus(), file_name="clo_metrics.prom",
+                             mime="text/plain", on_click="ignore")
+        if st.button("Reset Metrics"):
+            METRICS.reset()
+
+
+@timed("page")
 def run_clo_model():
     st.title("CLO Waterfall")
 
@@ -30,7 +452,7 @@ def run_clo_model():
 
         equity_size = total_collateral - senior_size - mezz_size
 
-        scenario = st.selectbox("Stress Scenario", ["Custom", "Mild", "Moderate", "Severe"])
+        scenario = st.selectbox("Stress Scenario", ["Custom"] + list(STRESS_SCENARIOS))
 
         reinvest_toggle = st.checkbox("Enable Reinvestment Period (Years 1–3)", value=True)
 
@@ -41,18 +463,10 @@ def run_clo_model():
             default_rate = st.slider("Default Rate (%)", 0.0, 40.0, 10.0)
             recovery_rate = st.slider("Recovery Rate (%)", 0.0, 100.0, 30.0)
             collateral_yield = st.slider("Collateral Yield (%)", 5.0, 20.0, 10.0)
-        elif scenario == "Mild":
-            default_rate = 5.0
-            recovery_rate = 40.0
-            collateral_yield = 10.0
-        elif scenario == "Moderate":
-            default_rate = 15.0
-            recovery_rate = 30.0
-            collateral_yield = 9.0
-        elif scenario == "Severe":
-            default_rate = 30.0
-            recovery_rate = 20.0
-            collateral_yield = 7.0
+        else:
+            default_rate = STRESS_SCENARIOS[scenario]["default_rate"]
+            recovery_rate = STRESS_SCENARIOS[scenario]["recovery_rate"]
+            collateral_yield = STRESS_SCENARIOS[scenario]["collateral_yield"]
 
         st.markdown(f"""
         **Scenario Settings**  
@@ -64,6 +478,11 @@ def run_clo_model():
         mezz_rate = st.number_input("Mezz Coupon (%)", 1.0, 15.0, 8.0, step=0.5)
         years = st.number_input("Years", 1, 10, 5)
 
+        profiling = st.checkbox("Show Profiling Panel", value=False,
+                                help="Times each stage of the page and counts simulations and cache hits. "
+                                     "Collection is process-wide and is switched on by starting the server "
+                                     "with CLO_METRICS=1.")
+
     int_income = total_collateral * (collateral_yield / 100) * years
     default_loss = total_collateral * (default_rate / 100)
     recoveries = default_loss * (recovery_rate / 100)
@@ -75,9 +494,7 @@ def run_clo_model():
 
     remaining_cash = available_cash
 
-    from clo_periodic_cashflow import simulate_clo_cashflows
-
-    df, sr_irr, mz_irr, eq_irr = simulate_clo_cashflows(
+    scenario = simulate_scenario(
         total_collateral,
         senior_size,
         mezz_size,
@@ -90,24 +507,34 @@ def run_clo_model():
         years,
         reinvest_toggle
     )
+    result = scenario["result"]
+    # Column totals come with the result, so the visuals never need the monthly table itself.
+    totals = {name: float(total[0]) for name, total in result.totals.items()}
+    senior_irr, mezz_irr, equity_irr = scenario["irr"]
 
     # Use cumulative results for visuals
-    senior_paid = df["Senior Interest"].sum() + df["Senior Principal"].sum()
-    mezz_paid = df["Mezz Interest"].sum() + df["Mezz Principal"].sum()
-    principal_paid = df["Senior Principal"].sum() + df["Mezz Principal"].sum()
-    equity_paid = df["Equity Cash"].sum()
+    senior_paid = totals["Senior Interest"] + totals["Senior Principal"]
+    mezz_paid = totals["Mezz Interest"] + totals["Mezz Principal"]
+    principal_paid = totals["Senior Principal"] + totals["Mezz Principal"]
+    equity_paid = totals["Equity Cash"]
     expected_loss = total_collateral * (default_rate / 100) * (1 - recovery_rate / 100)
-    net_cash = senior_paid + mezz_paid + principal_paid + equity_paid
-
-    chart_view = st.selectbox("Select Chart View", ["Simplified Tranche View", "Simplified Waterfall View"], index=0)
 
-    def status_flag(actual, expected):
-        if actual >= expected:
-            return "✅"
-        elif actual > 0:
-            return "⚠️"
-        else:
-            return "❌"
+    chart_view = st.selectbox("Select Chart View",
+                              ["Simplified Tranche View", "Simplified Waterfall View", "Sensitivity Heatmap",
+                               "Stress Sweep", "Breakeven Solver"], index=0)
+    base = dict(
+        total_collateral=total_collateral,
+        senior_size=senior_size,
+        mezz_size=mezz_size,
+        equity_size=equity_size,
+        senior_rate=senior_rate,
+        mezz_rate=mezz_rate,
+        default_rate=default_rate,
+        recovery_rate=recovery_rate,
+        collateral_yield=collateral_yield,
+        years=years,
+        reinvest_toggle=reinvest_toggle,
+    )
 
     if chart_view == "Simplified Tranche View":
         tranches = list(reversed([
@@ -118,58 +545,8 @@ def run_clo_model():
             {"label": "Equity", "expected": equity_paid + 1e-6, "paid": equity_paid, "color": "rgba(179,205,224, 0.4)"}
         ]))
 
-        fig = go.Figure()
-        y_base = 0
-        bar_gap = 0.3
-        bar_height = 0.9
-
-        for i, tranche in enumerate(tranches):
-            pct_paid = min(tranche["paid"] / tranche["expected"], 1.0)
-            filled_height = bar_height * pct_paid
-            empty_height = bar_height - filled_height
-            color = tranche["color"]
-            label = tranche["label"]
-            flag = status_flag(tranche["paid"], tranche["expected"])
-
-            fig.add_shape(type="rect", x0=0.3, x1=0.7, y0=y_base, y1=y_base + filled_height, fillcolor=color,
-                          line=dict(color="black", width=1), layer="below")
-
-            if empty_height > 0:
-                fig.add_shape(type="rect", x0=0.3, x1=0.7, y0=y_base + filled_height, y1=y_base + bar_height,
-                              fillcolor="rgba(230,230,230,0.3)", line=dict(color="gray", width=0.5), layer="below")
-
-            fig.add_annotation(x=0.75, y=y_base + bar_height / 2,
-                               text=f"<b>{label}</b> {flag}<br>${tranche['paid']:,.0f}", showarrow=False,
-                               font=dict(size=14, color="black", family="Helvetica"), align="left", xanchor="left")
-
-            fig.add_annotation(
-                x=0.3, y=y_base + bar_height / 2,
-                ax=0.15, ay=y_base + bar_height / 2,
-                xref="x", yref="y",
-                axref="x", ayref="y",
-                showarrow=True,
-                arrowhead=2,
-                arrowsize=1,
-                arrowwidth=2,
-                arrowcolor="gray"
-            )
-
-            y_base += bar_height + bar_gap
-
-        fig.add_shape(type="rect", x0=0.0, x1=0.15, y0=0, y1=y_base - bar_gap, fillcolor="rgba(180,220,255,0.6)",
-                      line=dict(color="black", width=1), layer="below")
-        fig.add_annotation(x=0.075, y=(y_base - bar_gap) / 2, text=f"<b>Loan Pool</b><br>${total_collateral:,.0f}",
-                           showarrow=False, font=dict(size=13, color="black"), align="center")
-
-        fig.update_layout(
-            autosize=True,
-            height=750,
-            margin=dict(t=50, l=40, r=40, b=50),
-            xaxis=dict(range=[0, 1], visible=False),
-            yaxis=dict(range=[0, y_base + 1], visible=False),
-            title="",
-            plot_bgcolor="rgba(0,0,0,0)"
-        )
+        with METRICS.span("tranche_figure"):
+            fig = cached_figure(base, "tranche", lambda: tranche_figure(tranches, total_collateral))
 
         left_spacer, center_col, right_spacer = st.columns([0.1, 0.8, 0.1])
 
@@ -193,43 +570,14 @@ def run_clo_model():
             st.markdown(f'<div class="{chart_html_id}">', unsafe_allow_html=True)
 
             # Render the chart using container width
-            st.plotly_chart(fig, use_container_width=True)
+            with METRICS.span("render_chart"):
+                st.plotly_chart(fig, use_container_width=True)
 
         # Tranche Summary Breakdown
-        senior_interest_paid = df["Senior Interest"].sum()
-        senior_principal_paid = df["Senior Principal"].sum()
-        mezz_interest_paid = df["Mezzanine Interest"].sum() if "Mezzanine Interest" in df.columns else df[
-            "Mezz Interest"].sum()
-        mezz_principal_paid = df["Mezz Principal"].sum()
-        equity_paid = df["Equity Cash"].sum()
+        render_tranche_summary(totals, expected_loss)
 
-        expected_loss = total_collateral * (default_rate / 100) * (1 - recovery_rate / 100)
-        net_cash = senior_interest_paid + senior_principal_paid + mezz_interest_paid + mezz_principal_paid + equity_paid
-
-        st.subheader("Tranche Summary")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.metric("Senior Interest", f"${senior_interest_paid / 1_000_000:.2f}M")
-            st.metric("Senior Principal", f"${senior_principal_paid / 1_000_000:.2f}M")
-        with col2:
-            st.metric("Mezzanine Interest", f"${mezz_interest_paid / 1_000_000:.2f}M")
-            st.metric("Mezzanine Principal", f"${mezz_principal_paid / 1_000_000:.2f}M")
-        with col3:
-            st.metric("Equity Residual", f"${equity_paid / 1_000_000:.2f}M")
-            st.metric("Expected Loss", f"${expected_loss / 1_000_000:.2f}M")
-            st.metric("Net Cash Distributed", f"${net_cash / 1_000_000:.2f}M")
-
-            # Close the wrapper
-            st.markdown("</div>", unsafe_allow_html=True)
-
-        # IRR Calculations
-        senior_cf = [-senior_size] + [senior_paid / years] * (years - 1) + [senior_paid / years + senior_size]
-        mezz_cf = [-mezz_size] + [mezz_paid / years] * (years - 1) + [mezz_paid / years + mezz_size]
-        equity_cf = [-equity_size] + [equity_paid / years] * years
-
-        senior_irr = npf.irr(senior_cf) * 100
-        mezz_irr = npf.irr(mezz_cf) * 100
-        equity_irr = npf.irr(equity_cf) * 100
+        # Close the wrapper
+        st.markdown("</div>", unsafe_allow_html=True)
 
         st.subheader("Tranche IRRs")
         col1, col2, col3 = st.columns(3)
@@ -239,23 +587,17 @@ def run_clo_model():
         col3.metric("Equity IRR", f"{equity_irr:.2f}%" if not pd.isna(equity_irr) else "n/a")
 
         st.subheader("Annual Cash Flow Summary")
-        annual_df = create_clo_annual_cashflow_summary(df, years)
-        for col in ["Senior Cash Flow", "Mezzanine Cash Flow", "Equity Cash Flow"]:
-            annual_df[col] = annual_df[col].apply(lambda x: f"${x / 1_000_000:.2f}M")
-        st.dataframe(annual_df, use_container_width=True)
+        render_annual_table(scenario["annual"])
 
         # Monthly Cashflows
-        df.rename(columns={"Mezz Interest": "Mezzanine Interest"}, inplace=True)
-        df.rename(columns={"Mezz Principal": "Mezzanine Principal"}, inplace=True)
         st.subheader("Monthly Cashflows")
-        st.dataframe(df, use_container_width=True)
+        render_monthly_table(result, key="tranche_monthly_page")
 
     # WATERFALL VIEW:
 
     elif chart_view == "Simplified Waterfall View":
         senior_flag = status_flag(senior_paid, senior_interest)
         mezz_flag = status_flag(mezz_paid, mezz_interest)
-        principal_flag = status_flag(principal_paid, principal_repayment)
         equity_flag = status_flag(equity_paid, 0.01)
         expected_senior_total = senior_interest + principal_repayment * (senior_size / (senior_size + mezz_size))
         expected_mezz_total = mezz_interest + principal_repayment * (mezz_size / (senior_size + mezz_size))
@@ -274,7 +616,6 @@ def run_clo_model():
             equity_paid if equity_paid > 0 else -1_000_000
         ]
 
-        measure = ["relative", "relative", "relative", "relative"]
         show_percentage = st.checkbox("Show Percent of Expected Payout", value=False)
 
         def format_millions(value):
@@ -298,51 +639,12 @@ def run_clo_model():
             f"Equity Residual: ${equity_paid:,.0f} {equity_flag}"
         ]
 
-        fig = go.Figure(go.Waterfall(
-            name="CLO Waterfall",
-            orientation="v",
-            measure=measure,
-            x=x_labels,
-            y=y_values,
-            text=text_labels,
-            textposition="inside",
-            texttemplate="%{text}",
-            insidetextfont=dict(color="white", size=14, family="Helvetica"),
-            hovertext=hover_text,
-            hoverinfo="text",
-            connector={"line": {"color": "#666", "width": 1.5}},
-            decreasing={"marker": {"color": "#003366"}},
-            increasing={"marker": {"color": "#cc0000"}},
-            totals={"marker": {"color": "#27a119"}},
-            opacity=0.85
-        ))
-
-        fig.update_layout(
-            title="",
-            showlegend=False,
-            xaxis=dict(
-                title=dict(text="Cash Flow Step", font=dict(color="black", size=14)),
-                tickfont=dict(color="black")
-            ),
-            yaxis=dict(
-                title=dict(text="Amount ($)", font=dict(color="black", size=14)),
-                tickfont=dict(color="black"),
-                range=[-available_cash * 1.05, available_cash * 1.05]
-            ),
-            margin=dict(t=50, l=80, r=80, b=120),
-            autosize=True,
-            height=750,
-            transition_duration=500
-        )
-
-        senior_cf = [-senior_size] + [senior_paid / years] * (years - 1) + [senior_paid / years + senior_size]
-        mezz_cf = [-mezz_size] + [mezz_paid / years] * (years - 1) + [mezz_paid / years + mezz_size]
-        equity_cf = [-equity_size] + [equity_paid / years] * years
+        with METRICS.span("waterfall_figure"):
+            fig = cached_figure(base, "waterfall", lambda: waterfall_figure(
+                x_labels, y_values, text_labels, hover_text, available_cash), show_percentage=show_percentage)
 
-        senior_irr = npf.irr(senior_cf) * 100
-        mezz_irr = npf.irr(mezz_cf) * 100
-        equity_irr = npf.irr(equity_cf) * 100
-        st.plotly_chart(fig)
+        with METRICS.span("render_chart"):
+            st.plotly_chart(fig)
         # IRR Summary
         st.subheader("Tranche IRRs")
         col1, col2, col3 = st.columns(3)
@@ -351,43 +653,31 @@ def run_clo_model():
         col3.metric("Equity IRR", f"{equity_irr:.2f}%")
 
         # Tranche Summary Breakdown
-        senior_interest_paid = df["Senior Interest"].sum()
-        senior_principal_paid = df["Senior Principal"].sum()
-        mezz_interest_paid = df["Mezzanine Interest"].sum() if "Mezzanine Interest" in df.columns else df[
-            "Mezz Interest"].sum()
-        mezz_principal_paid = df["Mezz Principal"].sum()
-        equity_paid = df["Equity Cash"].sum()
-
-        expected_loss = total_collateral * (default_rate / 100) * (1 - recovery_rate / 100)
-        net_cash = senior_interest_paid + senior_principal_paid + mezz_interest_paid + mezz_principal_paid + equity_paid
-
-        st.subheader("Tranche Summary")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.metric("Senior Interest", f"${senior_interest_paid / 1_000_000:.2f}M")
-            st.metric("Senior Principal", f"${senior_principal_paid / 1_000_000:.2f}M")
-        with col2:
-            st.metric("Mezzanine Interest", f"${mezz_interest_paid / 1_000_000:.2f}M")
-            st.metric("Mezzanine Principal", f"${mezz_principal_paid / 1_000_000:.2f}M")
-        with col3:
-            st.metric("Equity Residual", f"${equity_paid / 1_000_000:.2f}M")
-            st.metric("Expected Loss", f"${expected_loss / 1_000_000:.2f}M")
-            st.metric("Net Cash Distributed", f"${net_cash / 1_000_000:.2f}M")
+        render_tranche_summary(totals, expected_loss)
 
         # Annual Summary
         st.subheader("Annual Cash Flow Summary")
-        annual_df = create_clo_annual_cashflow_summary(df, years)
-        for col in ["Senior Cash Flow", "Mezzanine Cash Flow", "Equity Cash Flow"]:
-            annual_df[col] = annual_df[col].apply(lambda x: f"${x / 1_000_000:.2f}M")
-        st.dataframe(annual_df, use_container_width=True)
+        render_annual_table(scenario["annual"])
 
         # Monthly Cashflows
-        df.rename(columns={"Mezz Interest": "Mezzanine Interest"}, inplace=True)
-        df.rename(columns={"Mezz Principal": "Mezzanine Principal"}, inplace=True)
         st.subheader("Monthly Cashflows")
-        st.dataframe(df, use_container_width=True)
+        render_monthly_table(result, key="waterfall_monthly_page")
+
+    # SENSITIVITY VIEW:
+
+    elif chart_view == "Sensitivity Heatmap":
+        render_sensitivity_heatmap(base)
 
+    # STRESS SWEEP VIEW:
 
+    elif chart_view == "Stress Sweep":
+        render_stress_sweep(base)
 
+    # BREAKEVEN VIEW:
 
+    elif chart_view == "Breakeven Solver":
+        render_breakeven_solver(base)
 
+    render_export(scenario)
+    if profiling:
+        render_profiling_panel()
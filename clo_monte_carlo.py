@@ -0,0 +1,95 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from clo_periodic_cashflow import run_clo_waterfall, scheduled_principal
+
+PATH_COLUMNS = ["Senior IRR", "Mezz IRR", "Equity IRR", "Collateral Loss", "Senior Shortfall", "Mezz Shortfall"]
+
+
+def simulate_default_paths(rng, n_paths, months, default_rate, correlation=0.2, buckets=100):
+    # One-factor Gaussian copula over equally sized loan buckets. Each bucket defaults when its latent
+    # variable falls below the threshold implied by default_rate (the expected lifetime default %), and
+    # defaulting buckets get a uniform random default month. Returns the (path, month) fraction of
+    # collateral defaulting each month.
+    threshold = NormalDist().inv_cdf(min(max(default_rate / 100, 1e-12), 1 - 1e-12))
+    factor = rng.standard_normal((n_paths, 1))
+    latent = np.sqrt(correlation) * factor + np.sqrt(1 - correlation) * rng.standard_normal((n_paths, buckets))
+    path, _ = np.nonzero(latent < threshold)
+    month = rng.integers(0, months, size=len(path))
+    counts = np.bincount(path * months + month, minlength=n_paths * months)
+    return counts.reshape(n_paths, months) / buckets
+
+
+def _run_chunk(shm_name, n_paths, start, stop, seed, deal, years, reinvest_toggle, correlation, buckets):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray((len(PATH_COLUMNS), n_paths), dtype=float, buffer=shm.buf)
+        rng = np.random.default_rng(seed)
+        schedule = simulate_default_paths(rng, stop - start, int(years * 12), deal["default_rate"],
+                                          correlation, buckets)
+        result = run_clo_waterfall(**deal, years=years, reinvest_toggle=reinvest_toggle, summary_only=True,
+                                   default_schedule=schedule)
+        sr_irr, mz_irr, eq_irr = result.irr()
+        out[0, start:stop] = sr_irr
+        out[1, start:stop] = mz_irr
+        out[2, start:stop] = eq_irr
+        out[3, start:stop] = schedule.sum(axis=1) * deal["total_collateral"] * (1 - deal["recovery_rate"] / 100)
+        # Shortfall against the principal the waterfall schedules, which excludes the reinvestment period.
+        months = result.months
+        out[4, start:stop] = (scheduled_principal(deal["senior_size"], months, reinvest_toggle)
+                              - result.totals["Senior Principal"])
+        out[5, start:stop] = (scheduled_principal(deal["mezz_size"], months, reinvest_toggle)
+                              - result.totals["Mezz Principal"])
+    finally:
+        shm.close()
+
+
+def run_monte_carlo(total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate, default_rate,
+                    recovery_rate, collateral_yield, years, reinvest_toggle=False, n_paths=10_000, seed=None,
+                    correlation=0.2, buckets=100, workers=None, chunk_size=5_000):
+    # Runs n_paths stochastic default paths through the waterfall and returns one row per path. Paths are
+    # generated in fixed chunks, each from its own child of SeedSequence(seed), so a given seed and
+    # chunk_size reproduce the same paths whatever the number of workers. Chunks run in a process pool and
+    # write straight into a shared-memory result block.
+    deal = dict(total_collateral=total_collateral, senior_size=senior_size, mezz_size=mezz_size,
+                equity_size=equity_size, senior_rate=senior_rate, mezz_rate=mezz_rate, default_rate=default_rate,
+                recovery_rate=recovery_rate, collateral_yield=collateral_yield)
+    starts = list(range(0, n_paths, chunk_size))
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    jobs = [(start, min(start + chunk_size, n_paths), s, deal, years, reinvest_toggle, correlation, buckets)
+            for start, s in zip(starts, seeds)]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(len(PATH_COLUMNS) * n_paths * 8, 1))
+    try:
+        if workers <= 1:
+            for job in jobs:
+                _run_chunk(shm.name, n_paths, *job)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for future in [pool.submit(_run_chunk, shm.name, n_paths, *job) for job in jobs]:
+                    future.result()
+        out = np.ndarray((len(PATH_COLUMNS), n_paths), dtype=float, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return pd.DataFrame(out.T, columns=PATH_COLUMNS)
+
+
+def summarize_monte_carlo(paths, percentiles=(50, 95, 99, 99.9), tolerance=0.01):
+    # Loss percentiles, tranche IRR percentiles and the probability of a principal shortfall larger than
+    # `tolerance` dollars, from the output of run_monte_carlo.
+    summary = {"Paths": len(paths)}
+    for p in percentiles:
+        summary[f"Collateral Loss P{p:g}"] = np.percentile(paths["Collateral Loss"], p)
+    for col in ["Senior IRR", "Mezz IRR", "Equity IRR"]:
+        for p in (1, 5, 50):
+            summary[f"{col} P{p:g}"] = np.nanpercentile(paths[col], p) if paths[col].notna().any() else np.nan
+    summary["Senior Shortfall Probability"] = (paths["Senior Shortfall"] > tolerance).mean()
+    summary["Mezz Shortfall Probability"] = (paths["Mezz Shortfall"] > tolerance).mean()
+    return pd.Series(summary)
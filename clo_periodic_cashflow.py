@@ -1,54 +1,188 @@
+import numpy as np
 import pandas as pd
-import numpy_financial as npf
 
-def simulate_clo_cashflows(total_collateral,senior_size,mezz_size,equity_size,senior_rate,mezz_rate,default_rate,recovery_rate,collateral_yield,years,reinvest_toggle=False):
-    months=years*12
-    senior_bal=senior_size
-    mezz_bal=mezz_size
+from clo_irr import irr
+from clo_metrics import METRICS, timed
 
-    senior_cf=[-senior_size]
-    mezz_cf=[-mezz_size]
-    equity_cf=[-equity_size]
+CASHFLOW_COLUMNS = ["Senior Interest", "Senior Principal", "Mezz Interest", "Mezz Principal", "Equity Cash"]
+# Part of every persisted result key (see clo_store); bump it whenever a change alters computed results.
+ENGINE_VERSION = 1
+# Collateral assumptions of the named stress scenarios, as overrides of the simulate_clo_cashflows inputs.
+STRESS_SCENARIOS = {
+    "Mild": {"default_rate": 5.0, "recovery_rate": 40.0, "collateral_yield": 10.0},
+    "Moderate": {"default_rate": 15.0, "recovery_rate": 30.0, "collateral_yield": 9.0},
+    "Severe": {"default_rate": 30.0, "recovery_rate": 20.0, "collateral_yield": 7.0},
+}
 
-    df=pd.DataFrame(columns=["Month","Senior Interest","Senior Principal","Mezz Interest","Mezz Principal","Equity Cash"])
-    for m in range(1,months+1):
-        int_income=total_collateral*(collateral_yield/100/12)
-        default_amt=total_collateral*(default_rate/100/months)
-        recovery_amt=default_amt*(recovery_rate/100)
-        available_cash=int_income+recovery_amt-default_amt
 
-        sr_int_due=senior_bal*(senior_rate/100/12)
-        sr_int_paid=min(sr_int_due,available_cash)
-        available_cash-=sr_int_paid
+def simulate_clo_cashflows(total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+                           default_rate, recovery_rate, collateral_yield, years, reinvest_toggle=False):
+    result = run_clo_waterfall(total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+                               default_rate, recovery_rate, collateral_yield, years, reinvest_toggle)
 
-        mz_int_due=mezz_bal*(mezz_rate/100/12)
-        mz_int_paid=min(mz_int_due,available_cash)
-        available_cash-=mz_int_paid
+    sr_irr, mz_irr, eq_irr = result.irr()
+
+    return result.to_frame(), sr_irr[0], mz_irr[0], eq_irr[0]
+
+
+def simulate_clo_cashflows_batch(total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+                                 default_rate, recovery_rate, collateral_yield, years, reinvest_toggle=False):
+    result = run_clo_waterfall(total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+                               default_rate, recovery_rate, collateral_yield, years, reinvest_toggle,
+                               summary_only=True)
+    sr_irr, mz_irr, eq_irr = result.irr()
+    return result.senior_cf, result.mezz_cf, result.equity_cf, sr_irr, mz_irr, eq_irr
+
+
+class CloCashflowResult:
+    # Array-backed output of run_clo_waterfall. `monthly` is one preallocated (column, month, scenario)
+    # buffer, or None for summary-only runs; a DataFrame is only built when to_frame() is called.
+    __slots__ = ("months", "monthly", "totals", "senior_cf", "mezz_cf", "equity_cf", "_irr")
+
+    def __init__(self, months, monthly, totals, senior_cf, mezz_cf, equity_cf):
+        self.months = months
+        self.monthly = monthly
+        self.totals = totals
+        self.senior_cf = senior_cf
+        self.mezz_cf = mezz_cf
+        self.equity_cf = equity_cf
+        self._irr = None
+
+    def __len__(self):
+        return self.senior_cf.shape[0]
+
+    def column(self, name):
+        if self.monthly is None:
+            raise ValueError("summary-only result has no monthly rows")
+        return self.monthly[CASHFLOW_COLUMNS.index(name)].T
+
+    def irr(self):
+        # Annualised senior, mezz and equity IRRs in percent, one entry per scenario.
+        if self._irr is None:
+            self._irr = tuple(irr(cf)[0] * 12 * 100 for cf in (self.senior_cf, self.mezz_cf, self.equity_cf))
+        return self._irr
+
+    def to_frame(self, scenario=0, start=0, stop=None):
+        # Monthly rows of one scenario; start/stop select a slice of months (0-based, like range) without
+        # building the rest of the table.
+        if self.monthly is None:
+            raise ValueError("summary-only result has no monthly rows")
+        start, stop, _ = slice(start, stop).indices(self.months)
+        month = np.arange(start + 1, stop + 1)
+        df = pd.DataFrame(self.monthly[:, start:stop, scenario].T, columns=CASHFLOW_COLUMNS, index=month)
+        df.insert(0, "Month", month.astype(float))
+        return df
 
-        if reinvest_toggle and m <= 36:
-            sr_prin_paid = 0
-            mz_prin_paid = 0
-        else:
-            sr_prin_sched = senior_size / months
-            sr_prin_paid = min(sr_prin_sched, senior_bal, available_cash)
-            senior_bal -= sr_prin_paid
-            available_cash -= sr_prin_paid
 
-            mz_prin_sched = mezz_size / months
-            mz_prin_paid = min(mz_prin_sched, mezz_bal, available_cash)
-            mezz_bal -= mz_prin_paid
-            available_cash -= mz_prin_paid
+def scheduled_principal(size, months, reinvest_toggle=False):
+    # Principal the waterfall is scheduled to repay over the horizon: size / months for every month after
+    # the reinvestment period (the first 36 months, when reinvesting).
+    paying_months = months - (min(36, months) if reinvest_toggle else 0)
+    return np.asarray(size, dtype=float) * (paying_months / months)
 
-        eq_paid=max(available_cash,0)
 
-        senior_cf.append(sr_int_paid+sr_prin_paid)
-        mezz_cf.append(mz_int_paid+mz_prin_paid)
-        equity_cf.append(eq_paid)
+def collateral_cash_flows(total_collateral, default_rate, recovery_rate, collateral_yield, months,
+                          default_schedule=None):
+    # Cash the collateral pool passes to the waterfall each month: interest on the original balance plus
+    # recoveries, less defaults. (scenario,) when it is the same every month, else (scenario, month).
+    total_collateral = np.asarray(total_collateral, dtype=float)
+    int_income = total_collateral * (np.asarray(collateral_yield, dtype=float) / 100 / 12)
+    if default_schedule is None:
+        default_amt = total_collateral * (np.asarray(default_rate, dtype=float) / 100 / months)
+    else:
+        default_amt = total_collateral[..., None] * default_schedule
+        int_income = int_income[..., None]
+        recovery_rate = np.asarray(recovery_rate, dtype=float)[..., None]
+    recovery_amt = default_amt * (recovery_rate / 100)
+    return int_income + recovery_amt - default_amt
+
+
+@timed("simulation")
+def run_clo_waterfall(total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+                      default_rate, recovery_rate, collateral_yield, years, reinvest_toggle=False,
+                      summary_only=False, default_schedule=None, collateral_cash=None):
+    # Every deal/assumption input may be a scalar or an array; they are broadcast to one row per scenario
+    # and the monthly waterfall is applied to all rows at once. With summary_only the monthly interest and
+    # principal rows are only accumulated into totals, never stored. default_schedule optionally replaces
+    # the flat default_rate / months haircut with a (scenario, month) matrix of the fraction of collateral
+    # defaulting in each month. collateral_cash, a precomputed (scenario,) or (scenario, month) array of
+    # cash reaching the waterfall, bypasses the collateral model entirely.
+    months = int(years * 12)
+    if default_schedule is not None:
+        default_schedule = np.atleast_2d(np.asarray(default_schedule, dtype=float))
+    if collateral_cash is not None:
+        collateral_cash = np.atleast_1d(np.asarray(collateral_cash, dtype=float))
+    rows = collateral_cash if collateral_cash is not None else default_schedule
+    scenarios = np.empty(1 if rows is None else len(rows))
+    inputs = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float)) for x in (
+        total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+        default_rate, recovery_rate, collateral_yield)], scenarios)[:-1]
+    (total_collateral, senior_size, mezz_size, equity_size, senior_rate, mezz_rate,
+     default_rate, recovery_rate, collateral_yield) = [x.ravel() for x in inputs]
+    n = len(total_collateral)
+    METRICS.incr("simulation_calls")
+    METRICS.incr("simulated_scenarios", n)
+
+    # Buffers are month-major so each month writes contiguous rows; the result exposes (scenario, month) views.
+    senior_cf = np.empty((months + 1, n))
+    mezz_cf = np.empty((months + 1, n))
+    equity_cf = np.empty((months + 1, n))
+    senior_cf[0] = -senior_size
+    mezz_cf[0] = -mezz_size
+    equity_cf[0] = -equity_size
+    if summary_only:
+        monthly = None
+        row = np.empty((len(CASHFLOW_COLUMNS), n))
+        totals = np.zeros((len(CASHFLOW_COLUMNS), n))
+    else:
+        monthly = np.empty((len(CASHFLOW_COLUMNS), months, n))
+
+    if collateral_cash is None:
+        collateral_cash = collateral_cash_flows(total_collateral, default_rate, recovery_rate, collateral_yield,
+                                                months, default_schedule).T
+    else:
+        collateral_cash = collateral_cash.T
+
+    sr_int_rate = senior_rate / 100 / 12
+    mz_int_rate = mezz_rate / 100 / 12
+    sr_prin_sched = senior_size / months
+    mz_prin_sched = mezz_size / months
+    senior_bal = senior_size.copy()
+    mezz_bal = mezz_size.copy()
+
+    for m in range(1, months + 1):
+        if not summary_only:
+            row = monthly[:, m - 1]
+        sr_int_paid, sr_prin_paid, mz_int_paid, mz_prin_paid, eq_paid = row
+        available_cash = collateral_cash if collateral_cash.ndim == 1 else collateral_cash[m - 1]
+
+        np.minimum(senior_bal * sr_int_rate, available_cash, out=sr_int_paid)
+        available_cash = available_cash - sr_int_paid
+
+        np.minimum(mezz_bal * mz_int_rate, available_cash, out=mz_int_paid)
+        available_cash = available_cash - mz_int_paid
+
+        if reinvest_toggle and m <= 36:
+            sr_prin_paid[:] = 0
+            mz_prin_paid[:] = 0
+        else:
+            np.minimum(np.minimum(sr_prin_sched, senior_bal), available_cash, out=sr_prin_paid)
+            senior_bal = senior_bal - sr_prin_paid
+            available_cash = available_cash - sr_prin_paid
+
+            np.minimum(np.minimum(mz_prin_sched, mezz_bal), available_cash, out=mz_prin_paid)
+            mezz_bal = mezz_bal - mz_prin_paid
+            available_cash = available_cash - mz_prin_paid
 
-        df.loc[m]=[m,sr_int_paid,sr_prin_paid,mz_int_paid,mz_prin_paid,eq_paid]
+        np.maximum(available_cash, 0, out=eq_paid)
 
-    sr_irr=npf.irr(senior_cf)*12*100
-    mz_irr=npf.irr(mezz_cf)*12*100
-    eq_irr=npf.irr(equity_cf)*12*100
+        np.add(sr_int_paid, sr_prin_paid, out=senior_cf[m])
+        np.add(mz_int_paid, mz_prin_paid, out=mezz_cf[m])
+        equity_cf[m] = eq_paid
+        if summary_only:
+            totals += row
 
-    return df,sr_irr,mz_irr,eq_irr
+    if not summary_only:
+        totals = monthly.sum(axis=1)
+    return CloCashflowResult(months, monthly, dict(zip(CASHFLOW_COLUMNS, totals)),
+                             senior_cf.T, mezz_cf.T, equity_cf.T)
@@ -0,0 +1,179 @@
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from clo_batch import INPUT_COLUMNS, read_scenarios, with_defaults
+from clo_export import ResultWriter
+from clo_irr import irr
+from clo_metrics import METRICS, timed
+from clo_periodic_cashflow import STRESS_SCENARIOS, run_clo_waterfall, scheduled_principal
+
+TRANCHES = ["Senior", "Mezz", "Equity"]
+# Position columns of a deal file: the fraction of each tranche held (1.0 is the whole tranche). A
+# missing column holds none of that tranche.
+WEIGHT_COLUMNS = {"Senior": "senior_weight", "Mezz": "mezz_weight", "Equity": "equity_weight"}
+
+
+def load_deals(path):
+    # Deal definitions from a CSV or Parquet file or a DataFrame: one row per deal with the
+    # simulate_clo_cashflows inputs, the position weights and an optional deal_id (row number otherwise).
+    if isinstance(path, pd.DataFrame):
+        deals = path.reset_index(drop=True)
+    else:
+        deals = pd.concat(read_scenarios(path, 100_000), ignore_index=True)
+    if not any(column in deals for column in WEIGHT_COLUMNS.values()):
+        raise ValueError(f"deal input has no position columns; expected any of {', '.join(WEIGHT_COLUMNS.values())}")
+    deals = with_defaults(deals.copy())
+    for column in WEIGHT_COLUMNS.values():
+        if column not in deals:
+            deals[column] = 0.0
+    if "deal_id" not in deals:
+        deals.insert(0, "deal_id", np.arange(len(deals)))
+    return deals
+
+
+class PortfolioResult:
+    # Output of run_portfolio. `cashflows` is the position-weighted monthly cash flow of the whole
+    # portfolio as one (scenario, tranche, month) array, month 0 holding the purchase at par and deals
+    # shorter than the longest contributing zeros after their maturity. `shortfall` is (scenario, tranche):
+    # scheduled principal not repaid on the debt tranches, invested capital not returned on equity.
+    # `deals` has one row per (deal, scenario) with the deal's tranche IRRs and position shortfalls.
+    __slots__ = ("scenarios", "cashflows", "shortfall", "deals")
+
+    def __init__(self, scenarios, cashflows, shortfall, deals):
+        self.scenarios = scenarios
+        self.cashflows = cashflows
+        self.shortfall = shortfall
+        self.deals = deals
+
+    @property
+    def months(self):
+        return self.cashflows.shape[2] - 1
+
+    def irr(self):
+        # Annualised portfolio IRR (%) per (scenario, tranche); NaN for tranches without positions.
+        rates = irr(self.cashflows.reshape(-1, self.months + 1))[0]
+        return rates.reshape(self.cashflows.shape[:2]) * 12 * 100
+
+    def summary(self):
+        # Invested, received, shortfall and IRR of each held tranche under each scenario.
+        index = pd.MultiIndex.from_product([self.scenarios, TRANCHES], names=["Scenario", "Tranche"])
+        return pd.DataFrame({
+            "Invested": -self.cashflows[:, :, 0].ravel(),
+            "Received": self.cashflows[:, :, 1:].sum(axis=2).ravel(),
+            "Shortfall": self.shortfall.ravel(),
+            "IRR (%)": self.irr().ravel(),
+        }, index=index)
+
+    def to_frame(self):
+        # Long format: one row per (scenario, month) with the portfolio's cash flow from each tranche.
+        scenarios, tranches, periods = self.cashflows.shape
+        frame = pd.DataFrame(self.cashflows.transpose(0, 2, 1).reshape(scenarios * periods, tranches),
+                             columns=[f"{tranche} Cash Flow" for tranche in TRANCHES])
+        frame.insert(0, "Month", np.tile(np.arange(periods), scenarios))
+        frame.insert(0, "Scenario", np.repeat(self.scenarios, periods))
+        return frame
+
+
+@timed("portfolio")
+def run_portfolio(deals, scenarios=None, chunksize=100_000):
+    # Revalues every deal of `deals` (see load_deals) under every scenario of `scenarios` (name -> overrides
+    # of the deal inputs, default STRESS_SCENARIOS; {} keeps a deal's own assumptions) and aggregates the
+    # held positions. Deals sharing a horizon and reinvestment flag run as deals x scenarios rows of one
+    # summary-only batched waterfall, at most `chunksize` rows at a time, and each chunk is reduced to
+    # position-weighted sums as soon as it is computed: memory is bounded by the chunk and the
+    # (scenario, tranche, month) totals, not by the size of the portfolio.
+    deals = load_deals(deals)
+    scenarios = STRESS_SCENARIOS if scenarios is None else scenarios
+    names = list(scenarios)
+    unknown = {name for overrides in scenarios.values() for name in overrides} - set(INPUT_COLUMNS[:-2])
+    if unknown:
+        raise ValueError(f"unknown scenario inputs: {', '.join(sorted(unknown))}")
+    n_scenarios = len(names)
+    # Per-scenario values of every overridden input, NaN where a scenario keeps the deal's own value.
+    overrides = {name: np.array([s.get(name, np.nan) for s in scenarios.values()], dtype=float)
+                 for name in {name for s in scenarios.values() for name in s}}
+    inputs = {name: deals[name].to_numpy(dtype=float) for name in INPUT_COLUMNS[:-2]}
+    weights = deals[list(WEIGHT_COLUMNS.values())].to_numpy(dtype=float)
+
+    cashflows = np.zeros((n_scenarios, len(TRANCHES), int(deals["years"].max() * 12) + 1))
+    shortfall = np.zeros((n_scenarios, len(TRANCHES)))
+    deal_irr = np.full((len(deals), n_scenarios, len(TRANCHES)), np.nan)
+    deal_shortfall = np.zeros((len(deals), n_scenarios, len(TRANCHES)))
+    step = max(1, chunksize // n_scenarios)
+
+    for (years, reinvest_toggle), group in deals.groupby(["years", "reinvest_toggle"], sort=False):
+        for start in range(0, len(group), step):
+            chunk = group.index.to_numpy()[start:start + step]
+            n = len(chunk)
+            # Rows are deal-major: deal i under scenario j is row i * n_scenarios + j.
+            params = {}
+            for name, values in inputs.items():
+                values = np.repeat(values[chunk], n_scenarios)
+                if name in overrides:
+                    override = np.tile(overrides[name], n)
+                    values = np.where(np.isnan(override), values, override)
+                params[name] = values
+            result = run_clo_waterfall(*params.values(), years, bool(reinvest_toggle), summary_only=True)
+            months = result.months
+
+            position = weights[chunk]
+            for t, cf in enumerate((result.senior_cf, result.mezz_cf, result.equity_cf)):
+                # cf.T is the engine's month-major buffer, so this view needs no copy.
+                cashflows[:, t, :months + 1] += np.einsum("d,mds->sm", position[:, t],
+                                                          cf.T.reshape(months + 1, n, n_scenarios))
+
+            unpaid = np.column_stack([
+                scheduled_principal(params["senior_size"], months, reinvest_toggle) - result.totals["Senior Principal"],
+                scheduled_principal(params["mezz_size"], months, reinvest_toggle) - result.totals["Mezz Principal"],
+                params["equity_size"] - result.totals["Equity Cash"],
+            ]).reshape(n, n_scenarios, len(TRANCHES))
+            deal_shortfall[chunk] = np.maximum(unpaid, 0) * position[:, None, :]
+            shortfall += deal_shortfall[chunk].sum(axis=0)
+            deal_irr[chunk] = np.stack(result.irr(), axis=-1).reshape(n, n_scenarios, len(TRANCHES))
+            METRICS.incr("portfolio_deal_scenarios", n * n_scenarios)
+
+    index = pd.MultiIndex.from_arrays([np.repeat(deals["deal_id"].to_numpy(), n_scenarios),
+                                       np.tile(names, len(deals))], names=["deal_id", "Scenario"])
+    columns = [f"{tranche} IRR" for tranche in TRANCHES] + [f"{tranche} Shortfall" for tranche in TRANCHES]
+    per_deal = pd.DataFrame(np.concatenate([deal_irr, deal_shortfall], axis=2).reshape(-1, len(columns)),
+                            index=index, columns=columns)
+    return PortfolioResult(names, cashflows, shortfall, per_deal)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Revalue a portfolio of CLO tranche positions under the "
+                                                 "stress scenarios.")
+    parser.add_argument("deals", help="deal file (.csv or .parquet) with one column per simulate_clo_cashflows "
+                                      f"argument and position columns {', '.join(WEIGHT_COLUMNS.values())}")
+    parser.add_argument("output", nargs="?",
+                        help="write the summary (.csv, .parquet or .xlsx) here; per-deal results and monthly "
+                             "portfolio cash flows go to sibling files or sheets")
+    parser.add_argument("--base", action="store_true", help="also value the deals under their own assumptions")
+    parser.add_argument("--chunksize", type=int, default=100_000,
+                        help="deal x scenario rows per batched run (default 100000)")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write timing spans and counters to PATH (Prometheus text for .prom/.txt, else JSON)")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        METRICS.enabled = True
+    scenarios = dict({"Base": {}} if args.base else {}, **STRESS_SCENARIOS)
+    result = run_portfolio(args.deals, scenarios, args.chunksize)
+    summary = result.summary()
+    if args.output:
+        with ResultWriter(args.output, default_table="Summary") as writer:
+            writer.write(summary.reset_index())
+            writer.write(result.deals.reset_index(), "Deals")
+            writer.write(result.to_frame(), "Monthly Cashflows")
+    else:
+        print(summary.to_string(float_format=lambda x: f"{x:,.2f}"))
+    print(f"revalued {len(result.deals)} deal scenarios", file=sys.stderr)
+    if args.metrics:
+        METRICS.dump(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
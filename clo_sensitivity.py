@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+from clo_periodic_cashflow import CASHFLOW_COLUMNS, collateral_cash_flows, run_clo_waterfall
+
+SENSITIVITY_PARAMS = ["default_rate", "recovery_rate", "collateral_yield", "senior_rate", "mezz_rate"]
+COLLATERAL_PARAMS = ["total_collateral", "default_rate", "recovery_rate", "collateral_yield"]
+METRICS = ["Senior IRR", "Mezz IRR", "Equity IRR"] + CASHFLOW_COLUMNS
+
+# Default one-point bumps for tranche_greeks, in the inputs' own units (percentage points).
+DEFAULT_BUMPS = {"default_rate": 1.0, "recovery_rate": 1.0, "collateral_yield": 0.25, "senior_rate": 0.25,
+                 "mezz_rate": 0.25}
+
+
+class SensitivityCube:
+    # Labelled results of sensitivity_grid: `axes` maps each bumped input to its values (in grid order)
+    # and `values` maps each metric to an array with one dimension per axis.
+    __slots__ = ("axes", "values")
+
+    def __init__(self, axes, values):
+        self.axes = axes
+        self.values = values
+
+    @property
+    def shape(self):
+        return tuple(len(v) for v in self.axes.values())
+
+    def to_frame(self):
+        index = pd.MultiIndex.from_product(list(self.axes.values()), names=list(self.axes))
+        return pd.DataFrame({m: v.ravel() for m, v in self.values.items()}, index=index)
+
+    def heatmap(self, metric, x, y):
+        # 2-D table of `metric` with y values down the rows and x values across the columns. Any other
+        # axis is held at its first value.
+        names = list(self.axes)
+        index = tuple(slice(None) if name in (x, y) else 0 for name in names)
+        table = self.values[metric][index]
+        if names.index(y) > names.index(x):
+            table = table.T
+        return pd.DataFrame(table, index=pd.Index(self.axes[y], name=y), columns=pd.Index(self.axes[x], name=x))
+
+
+def _run_grid(base, grid):
+    # grid maps input names to equally long arrays of values; everything else comes from base. The
+    # collateral cash depends only on the collateral inputs, so it is computed once per distinct
+    # collateral combination and shared by every coupon bump of that combination.
+    n = len(next(iter(grid.values())))
+    params = {k: np.broadcast_to(np.asarray(grid.get(k, base[k]), dtype=float), (n,)) for k in base
+              if k not in ("years", "reinvest_toggle")}
+    months = int(base["years"] * 12)
+    collateral = np.column_stack([params[k] for k in COLLATERAL_PARAMS])
+    unique, inverse = np.unique(collateral, axis=0, return_inverse=True)
+    cash = collateral_cash_flows(*unique.T, months)[inverse.ravel()]
+
+    result = run_clo_waterfall(params["total_collateral"], params["senior_size"], params["mezz_size"],
+                               params["equity_size"], params["senior_rate"], params["mezz_rate"], None, None, None,
+                               base["years"], base.get("reinvest_toggle", False), summary_only=True,
+                               collateral_cash=cash)
+    values = dict(zip(METRICS[:3], result.irr()))
+    values.update(result.totals)
+    return values
+
+
+def sensitivity_grid(base, axes):
+    # Evaluates every combination of `axes` (input name -> values) around the `base` inputs (the
+    # simulate_clo_cashflows arguments as a dict) in one batched waterfall run.
+    axes = {k: np.asarray(v, dtype=float) for k, v in axes.items()}
+    unknown = set(axes) - set(base)
+    if unknown:
+        raise ValueError(f"unknown sensitivity inputs: {', '.join(sorted(unknown))}")
+    mesh = np.meshgrid(*axes.values(), indexing="ij")
+    values = _run_grid(base, {k: m.ravel() for k, m in zip(axes, mesh)})
+    shape = tuple(len(v) for v in axes.values())
+    return SensitivityCube(axes, {m: values[m].reshape(shape) for m in METRICS})
+
+
+def tranche_greeks(base, bumps=None):
+    # Central-difference sensitivities of the tranche IRRs (IRR points per unit of each input), from one
+    # batched run of the base case and an up and a down bump per input.
+    bumps = bumps or DEFAULT_BUMPS
+    names = list(bumps)
+    grid = {k: np.full(1 + 2 * len(names), float(base[k])) for k in names}
+    for i, name in enumerate(names):
+        grid[name][1 + 2 * i] += bumps[name]
+        grid[name][2 + 2 * i] -= bumps[name]
+    values = _run_grid(base, grid)
+
+    rows = {}
+    for i, name in enumerate(names):
+        up, down = 1 + 2 * i, 2 + 2 * i
+        rows[name] = {m: (values[m][up] - values[m][down]) / (2 * bumps[name]) for m in METRICS[:3]}
+    return pd.DataFrame.from_dict(rows, orient="index")
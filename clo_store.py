@@ -0,0 +1,166 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+from clo_cache import scenario_key
+from clo_metrics import METRICS
+from clo_periodic_cashflow import ENGINE_VERSION
+
+# Reading an entry refreshes its eviction timestamp at most this often (seconds), so warm lookups rarely
+# have to write.
+TOUCH_INTERVAL = 3600
+
+
+def stored_key(params):
+    # scenario_key of a dict of inputs, tied to the engine version that computes the result.
+    return bytes.fromhex(scenario_key(dict(params, engine_version=ENGINE_VERSION)))
+
+
+def row_keys(frame, columns):
+    # One key per row of `frame`, hashing the float64 bytes of `columns` together with the column names
+    # and engine version. Much faster than stored_key for batch inputs; the two key spaces do not overlap.
+    prefix = f"{ENGINE_VERSION}|{'|'.join(columns)}|".encode()
+    values = np.ascontiguousarray(frame[columns].to_numpy(dtype=float))
+    return np.array([hashlib.sha256(prefix + row.tobytes()).digest() for row in values], dtype=object)
+
+
+class ResultStore:
+    # Persistent, content-addressed result store in a single SQLite file. Keys are SHA-256 digests
+    # (stored_key, row_keys) and values bytes; get_rows/put_rows store fixed-width float64 rows and
+    # get_arrays/put_arrays named numeric arrays in .npz form. Nothing is ever unpickled, so a store file
+    # shared with other users cannot run code in the reader. When the stored values exceed max_bytes the
+    # least recently used entries are evicted. Safe to share between threads; separate processes may open
+    # the same file.
+
+    def __init__(self, path, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, value BLOB NOT NULL, "
+                         "size INTEGER NOT NULL, accessed REAL NOT NULL) WITHOUT ROWID")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._evict()
+
+    def get_many(self, keys):
+        # {key: value} for the keys present in the store; reading an entry refreshes it for eviction. The
+        # keys are loaded, sorted, into a temporary table and joined, which is far faster than IN lists or
+        # point queries for the hundreds of thousands of keys of a batch chunk.
+        keys = list(keys)
+        now = time.time()
+        with self._lock:
+            # The connection as a context manager commits the transaction, or rolls it back on error.
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (key BLOB PRIMARY KEY) WITHOUT ROWID")
+                self._db.execute("DELETE FROM lookup")
+                self._db.executemany("INSERT INTO lookup VALUES (?)", ((key,) for key in sorted(set(keys))))
+                found = dict(self._db.execute("SELECT key, value FROM lookup JOIN results USING (key)"))
+                self._db.execute("UPDATE results SET accessed = ? WHERE accessed < ? AND key IN "
+                                 "(SELECT key FROM lookup)", (now, now - TOUCH_INTERVAL))
+            hits = sum(key in found for key in keys)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        METRICS.incr("store_hits", hits)
+        METRICS.incr("store_misses", len(keys) - hits)
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        rows = [(key, value, len(value), now) for key, value in items]
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% of the budget so a full store does not evict on every write.
+        excess = total - int(self.max_bytes * 0.9)
+        doomed, freed = [], 0
+        for key, size in self._db.execute("SELECT key, size FROM results ORDER BY accessed"):
+            if freed >= excess:
+                break
+            doomed.append((key,))
+            freed += size
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany("DELETE FROM results WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+        METRICS.incr("store_evictions", len(doomed))
+
+    def get_arrays(self, key):
+        # {name: array} stored under `key` by put_arrays, or None when missing. Values that are not an
+        # .npz of plain arrays (e.g. pickled objects written by older versions) count as missing.
+        value = self.get_many([key]).get(key)
+        if value is None:
+            return None
+        try:
+            with np.load(io.BytesIO(value), allow_pickle=False) as data:
+                return {name: data[name] for name in data.files}
+        except (ValueError, zipfile.BadZipFile):
+            return None
+
+    def put_arrays(self, key, arrays):
+        # Stores a dict of numeric arrays (no object dtypes) under `key`.
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        self.put_many([(key, buffer.getvalue())])
+
+    def get_rows(self, keys, width):
+        # Bulk lookup of float64 rows: returns a (len(keys), width) array (NaN where missing) and a boolean
+        # mask of the keys that were found.
+        found = self.get_many(keys)
+        values = np.full((len(keys), width), np.nan)
+        mask = np.fromiter((key in found for key in keys), dtype=bool, count=len(keys))
+        if mask.any():
+            stored = b"".join(found[key] for key, hit in zip(keys, mask) if hit)
+            values[mask] = np.frombuffer(stored, dtype=float).reshape(-1, width)
+        return values, mask
+
+    def put_rows(self, keys, values):
+        values = np.ascontiguousarray(values, dtype=float)
+        self.put_many((key, row.tobytes()) for key, row in zip(keys, values))
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": entries,
+                    "bytes": size, "max_bytes": self.max_bytes}
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM results")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_default_store = None
+
+
+def default_store():
+    # The store named by the CLO_RESULT_STORE environment variable (size limit CLO_RESULT_STORE_MB,
+    # default 1024), opened once per process; None when the variable is unset.
+    global _default_store
+    path = os.environ.get("CLO_RESULT_STORE")
+    if not path:
+        return None
+    if _default_store is None or _default_store.path != path:
+        _default_store = ResultStore(path, int(os.environ.get("CLO_RESULT_STORE_MB", 1024)) << 20)
+    return _default_store
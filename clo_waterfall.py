@@ -0,0 +1,245 @@
+import numpy as np
+
+from clo_irr import irr
+
+OP_FEE = 0
+OP_INTEREST = 1
+OP_PRINCIPAL = 2
+OP_OC_TEST = 3
+OP_IC_TEST = 4
+
+PRINCIPAL_SCHEDULED = 0
+PRINCIPAL_SEQUENTIAL = 1
+
+
+def two_tranche_spec(reinvest_toggle=False):
+    # The senior/mezz/equity waterfall of simulate_clo_cashflows as a declarative spec. Run through
+    # run_waterfall with flat_collateral it reproduces run_clo_waterfall exactly; run_clo_waterfall stays the
+    # specialised fast path for this shape.
+    return {
+        "tranches": ["Senior", "Mezz"],
+        "reinvestment_months": 36 if reinvest_toggle else 0,
+        "steps": [
+            {"pay": "interest", "tranche": "Senior"},
+            {"pay": "interest", "tranche": "Mezz"},
+            {"pay": "principal", "tranche": "Senior"},
+            {"pay": "principal", "tranche": "Mezz"},
+        ],
+    }
+
+
+def compile_waterfall(spec):
+    # Turns a priority-of-payments spec into a CompiledWaterfall. A spec is a dict with
+    #   "tranches":            debt tranche names, most senior first (equity is the implicit residual);
+    #   "reinvestment_months": months during which principal steps are skipped (default 0);
+    #   "steps":               the ordered priority of payments, each one of
+    #       {"pay": "fee", "name": ..., "rate": annual % of collateral par}
+    #       {"pay": "interest", "tranche": ...}
+    #       {"pay": "principal", "tranche": ..., "mode": "scheduled" (size / months, default) | "sequential"}
+    #       {"test": "oc", "tranche": ..., "trigger": %}  par / balance of classes up to and including tranche
+    #       {"test": "ic", "tranche": ..., "trigger": %}  interest collections / interest due on those classes
+    # A failing OC or IC test diverts the remaining cash to pay down principal sequentially from the most
+    # senior class until the test is cured or the cash runs out.
+    names = list(spec["tranches"])
+    index = {name: i for i, name in enumerate(names)}
+    if len(index) != len(names):
+        raise ValueError("tranche names must be unique")
+
+    ops, operands, params, fee_names = [], [], [], []
+    for step in spec["steps"]:
+        kind = step.get("pay") or step.get("test")
+        if kind == "fee":
+            ops.append(OP_FEE)
+            operands.append(len(fee_names))
+            params.append(float(step["rate"]))
+            fee_names.append(step.get("name", f"Fee {len(fee_names) + 1}"))
+            continue
+        if step.get("tranche") not in index:
+            raise ValueError(f"step {step!r} refers to an unknown tranche")
+        operands.append(index[step["tranche"]])
+        if kind == "interest" and "pay" in step:
+            ops.append(OP_INTEREST)
+            params.append(0.0)
+        elif kind == "principal" and "pay" in step:
+            mode = step.get("mode", "scheduled")
+            if mode not in ("scheduled", "sequential"):
+                raise ValueError(f"unknown principal mode {mode!r}")
+            ops.append(OP_PRINCIPAL)
+            params.append(PRINCIPAL_SCHEDULED if mode == "scheduled" else PRINCIPAL_SEQUENTIAL)
+        elif kind in ("oc", "ic") and "test" in step:
+            ops.append(OP_OC_TEST if kind == "oc" else OP_IC_TEST)
+            params.append(float(step["trigger"]))
+        else:
+            raise ValueError(f"unknown waterfall step {step!r}")
+
+    return CompiledWaterfall(tuple(names), tuple(fee_names), np.array(ops, dtype=np.int8),
+                             np.array(operands, dtype=np.intp), np.array(params, dtype=float),
+                             int(spec.get("reinvestment_months", 0)))
+
+
+class CompiledWaterfall:
+    __slots__ = ("tranches", "fees", "ops", "operands", "params", "reinvestment_months")
+
+    def __init__(self, tranches, fees, ops, operands, params, reinvestment_months):
+        self.tranches = tranches
+        self.fees = fees
+        self.ops = ops
+        self.operands = operands
+        self.params = params
+        self.reinvestment_months = reinvestment_months
+
+    def __repr__(self):
+        return f"CompiledWaterfall(tranches={self.tranches}, steps={len(self.ops)})"
+
+
+def flat_collateral(total_collateral, default_rate, recovery_rate, collateral_yield, months, default_schedule=None):
+    # The collateral model of simulate_clo_cashflows: interest on the full original balance every month and
+    # a flat default_rate / months haircut (or a (scenario, month) default_schedule fraction) net of
+    # recoveries. Returns (cash, interest, par), each broadcastable to (month, scenario).
+    total_collateral = np.atleast_1d(np.asarray(total_collateral, dtype=float))
+    int_income = total_collateral * (np.asarray(collateral_yield, dtype=float) / 100 / 12)
+    if default_schedule is None:
+        default_amt = total_collateral * (np.asarray(default_rate, dtype=float) / 100 / months)
+        default_amt = np.broadcast_to(default_amt, (months,) + np.shape(default_amt))
+    else:
+        default_amt = total_collateral * np.atleast_2d(np.asarray(default_schedule, dtype=float)).T
+    recovery_amt = default_amt * (np.asarray(recovery_rate, dtype=float) / 100)
+    cash = int_income + recovery_amt - default_amt
+    par = total_collateral - np.cumsum(default_amt, axis=0)
+    return cash, np.broadcast_to(int_income, cash.shape), par
+
+
+class WaterfallResult:
+    # Output of run_waterfall. Monthly arrays are month-major: interest and principal are
+    # (tranche, month, scenario), fees (fee, month, scenario) and equity (month, scenario).
+    __slots__ = ("tranches", "fees", "months", "interest", "principal", "fee_paid", "equity", "cashflows",
+                 "_irr")
+
+    def __init__(self, tranches, fees, months, interest, principal, fee_paid, equity, cashflows):
+        self.tranches = tranches
+        self.fees = fees
+        self.months = months
+        self.interest = interest
+        self.principal = principal
+        self.fee_paid = fee_paid
+        self.equity = equity
+        self.cashflows = cashflows
+        self._irr = None
+
+    def cashflow(self, tranche):
+        # (scenario, month) cash-flow matrix of a tranche or "Equity", including the initial outlay
+        k = len(self.tranches) if tranche == "Equity" else self.tranches.index(tranche)
+        return self.cashflows[k].T
+
+    def irr(self):
+        # Annualised IRRs in percent, one row per tranche and a last row for equity.
+        if self._irr is None:
+            self._irr = np.array([irr(cf.T)[0] * 12 * 100 for cf in self.cashflows])
+        return self._irr
+
+    def totals(self):
+        out = {}
+        for k, name in enumerate(self.tranches):
+            out[f"{name} Interest"] = self.interest[k].sum(axis=0)
+            out[f"{name} Principal"] = self.principal[k].sum(axis=0)
+        for f, name in enumerate(self.fees):
+            out[name] = self.fee_paid[f].sum(axis=0)
+        out["Equity Cash"] = self.equity.sum(axis=0)
+        return out
+
+
+def run_waterfall(program, sizes, rates, equity_size, cash, interest_collections, par, months,
+                  principal_collections=None):
+    # Executes a CompiledWaterfall for every scenario at once. sizes and rates (annual %) are (tranche,) or
+    # (scenario, tranche) and are held as (tranche, scenario) struct-of-arrays; cash, interest_collections
+    # and par come from a collateral model such as flat_collateral. The step loop runs once per month, and
+    # each step is a handful of vector operations over scenarios.
+    # With principal_collections (month, scenario) the waterfall keeps two accounts: `cash` is then the
+    # interest proceeds, paying fees, interest and test cures, while principal steps are paid only from
+    # principal proceeds. Principal collected during the reinvestment period is held and applied once it
+    # ends, or in the final month when the deal ends first, and only principal left after the principal
+    # steps reaches equity.
+    sizes = np.atleast_2d(np.asarray(sizes, dtype=float))
+    rates = np.atleast_2d(np.asarray(rates, dtype=float))
+    n = np.broadcast_shapes((len(sizes),), (len(rates),), np.shape(cash)[-1:],
+                            np.shape(interest_collections)[-1:], np.shape(par)[-1:], np.shape(equity_size)[-1:])[0]
+    n_tranches = len(program.tranches)
+    if sizes.shape[1] != n_tranches or rates.shape[1] != n_tranches:
+        raise ValueError(f"expected sizes and rates for {n_tranches} tranches")
+
+    balance = np.array(np.broadcast_to(sizes, (n, n_tranches)).T)
+    monthly_rate = np.broadcast_to(rates, (n, n_tranches)).T / 100 / 12
+    scheduled = balance / months
+    cash = np.broadcast_to(cash, (months, n))
+    interest_collections = np.broadcast_to(interest_collections, (months, n))
+    par = np.broadcast_to(par, (months, n))
+    if principal_collections is not None:
+        principal_collections = np.broadcast_to(principal_collections, (months, n))
+        principal_cash = np.zeros(n)
+
+    interest = np.zeros((n_tranches, months, n))
+    principal = np.zeros((n_tranches, months, n))
+    fee_paid = np.zeros((len(program.fees), months, n))
+    equity = np.empty((months, n))
+    steps = list(zip(program.ops.tolist(), program.operands.tolist(), program.params.tolist()))
+
+    for m in range(months):
+        available_cash = cash[m]
+        reinvesting = m < program.reinvestment_months
+        if principal_collections is not None:
+            reinvesting = reinvesting and m < months - 1
+            principal_cash = principal_cash + principal_collections[m]
+        for op, k, param in steps:
+            if op == OP_INTEREST:
+                paid = np.minimum(balance[k] * monthly_rate[k], available_cash)
+                interest[k, m] = paid
+                available_cash = available_cash - paid
+            elif op == OP_PRINCIPAL:
+                if reinvesting:
+                    continue
+                due = scheduled[k] if param == PRINCIPAL_SCHEDULED else balance[k]
+                if principal_collections is None:
+                    paid = np.minimum(np.minimum(due, balance[k]), available_cash)
+                    available_cash = available_cash - paid
+                else:
+                    paid = np.minimum(np.minimum(due, balance[k]), principal_cash)
+                    principal_cash = principal_cash - paid
+                principal[k, m] += paid
+                balance[k] -= paid
+            elif op == OP_FEE:
+                paid = np.minimum(par[m] * (param / 100 / 12), available_cash)
+                fee_paid[k, m] = paid
+                available_cash = available_cash - paid
+            elif op == OP_OC_TEST:
+                # Pay down classes in order until par covers their balance at the trigger ratio.
+                excess = np.maximum(balance[:k + 1].sum(axis=0) - par[m] / (param / 100), 0)
+                for j in range(k + 1):
+                    paid = np.minimum(np.minimum(excess, balance[j]), available_cash)
+                    principal[j, m] += paid
+                    balance[j] -= paid
+                    available_cash = available_cash - paid
+                    excess = excess - paid
+            elif op == OP_IC_TEST:
+                # Pay down classes in order until the interest they would still be due is covered.
+                due = (balance[:k + 1] * monthly_rate[:k + 1]).sum(axis=0)
+                excess = np.maximum(due - interest_collections[m] / (param / 100), 0)
+                for j in range(k + 1):
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        amount = np.where(monthly_rate[j] > 0, excess / monthly_rate[j], 0)
+                    paid = np.minimum(np.minimum(amount, balance[j]), available_cash)
+                    principal[j, m] += paid
+                    balance[j] -= paid
+                    available_cash = available_cash - paid
+                    excess = excess - paid * monthly_rate[j]
+        equity[m] = np.maximum(available_cash, 0)
+        if principal_collections is not None and not reinvesting:
+            equity[m] += principal_cash
+            principal_cash = np.zeros(n)
+
+    cashflows = np.empty((n_tranches + 1, months + 1, n))
+    cashflows[:n_tranches, 0] = -np.broadcast_to(sizes, (n, n_tranches)).T
+    cashflows[:n_tranches, 1:] = interest + principal
+    cashflows[n_tranches, 0] = -np.broadcast_to(np.asarray(equity_size, dtype=float), (n,))
+    cashflows[n_tranches, 1:] = equity
+    return WaterfallResult(program.tranches, program.fees, months, interest, principal, fee_paid, equity,
+                           cashflows)